@@ -0,0 +1,51 @@
+# Compares the str(dict) + eval() queue format with the JSON envelope of mef_mooc.scripts.messages
+# for a typical mail message and a db_exec message. Needs the usual .env.
+#
+#   python -m benchmarks.message_codec [iterations]
+
+import sys
+import time
+from mef_mooc.scripts.messages import MAIL, DB_EXEC, encode_message, decode_message
+
+MESSAGES = {
+    MAIL: {
+        'email': 'student@mef.edu.tr',
+        'template': 'invitation',
+        'params': {'password': 'ABCD1234'}
+    },
+    DB_EXEC: {
+        'query': "UPDATE bundle SET status = %s, complete_date = NOW() WHERE id = %s",
+        'params': ['Waiting Certificates', 42]
+    },
+}
+
+def legacy_encode(message_type, payload):
+    return str(payload).encode('utf-8')
+
+def legacy_decode(body, message_type):
+    return eval(body.decode())
+
+def envelope_encode(message_type, payload):
+    return encode_message(message_type, payload, trace_id='0' * 32)
+
+def envelope_decode(body, message_type):
+    return decode_message(body, message_type)['payload']
+
+def measure(function, iterations):
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return iterations / (time.perf_counter() - started_at)
+
+def main(iterations):
+    print("%-8s %-9s %14s %14s %8s" % ("type", "format", "encode/s", "decode/s", "bytes"))
+    for message_type, payload in MESSAGES.items():
+        for name, encode, decode in (("str/eval", legacy_encode, legacy_decode), ("envelope", envelope_encode, envelope_decode)):
+            body = encode(message_type, payload)
+            assert decode(body, message_type) == payload
+            encoded = measure(lambda: encode(message_type, payload), iterations)
+            decoded = measure(lambda: decode(body, message_type), iterations)
+            print("%-8s %-9s %14.0f %14.0f %8d" % (message_type, name, encoded, decoded, len(body)))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
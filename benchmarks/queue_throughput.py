@@ -0,0 +1,56 @@
+# Measures mails per second from Publisher.publish_batch to a delivered mail, through the receiver's consumer,
+# template rendering and the SMTP pool. Runs in one process on the in-memory broker and the capture SMTP sink,
+# so RabbitMQ and a mail server are not needed. Needs the usual .env.
+#
+#   python -m benchmarks.queue_throughput [messages] [smtp delay in ms]
+
+import os
+import sys
+import time
+import threading
+
+os.environ['BROKER_BACKEND'] = 'memory'
+os.environ['SMTP_BACKEND'] = 'capture'
+# Every benchmark mail is distinct anyway, this keeps Redis out of the measurement
+os.environ['MAIL_DEDUP_WINDOW'] = '0'
+
+import receiver
+from mef_mooc.config import MAIL_WORKERS, MAIL_PREFETCH
+from mef_mooc.scripts.messages import MAIL, encode_message
+from mef_mooc.scripts.transports import CaptureSMTP, connect_broker
+from mef_mooc.scripts.util import publisher
+
+def wait_for_mails(count, timeout=600):
+    deadline = time.monotonic() + timeout
+    while len(CaptureSMTP.messages) < count:
+        if time.monotonic() > deadline:
+            raise TimeoutError("Only %d of %d mails were delivered" % (len(CaptureSMTP.messages), count))
+        time.sleep(0.001)
+
+def main(count, smtp_delay):
+    CaptureSMTP.delay = smtp_delay
+    connection = connect_broker()
+    channel, consumers = receiver.start_consumers(connection)
+    consuming = threading.Thread(target=channel.start_consuming, daemon=True)
+    consuming.start()
+
+    bodies = [encode_message(MAIL, {'email': 'student%d@mef.edu.tr' % index, 'template': 'invitation',
+                                    'params': {'password': 'ABCD1234'}}) for index in range(count)]
+
+    started_at = time.perf_counter()
+    publisher.publish_batch('mail_sending', bodies)
+    published_at = time.perf_counter()
+    wait_for_mails(count)
+    delivered_at = time.perf_counter()
+
+    connection.add_callback_threadsafe(channel.stop_consuming)
+    consuming.join()
+    receiver.stop_consumers(connection, consumers)
+
+    print("messages %d, workers %d, prefetch %d, smtp delay %.1f ms" % (count, MAIL_WORKERS, MAIL_PREFETCH, smtp_delay * 1000))
+    print("publish  %10.1f ms %12.0f msg/s" % ((published_at - started_at) * 1000, count / (published_at - started_at)))
+    print("deliver  %10.1f ms %12.0f msg/s" % ((delivered_at - started_at) * 1000, count / (delivered_at - started_at)))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+         float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0)
@@ -0,0 +1,52 @@
+# Compares the DictCursor + dict(row) path of Database.fetch with the tuple based Database.fetch_rows
+# for the row shapes of /admin/moocs, /admin/students and the semester reports.
+# Rows are generated with generate_series, so no seed data is needed. Needs the usual .env.
+#
+#   python -m benchmarks.row_modes [rows ...]
+
+import sys
+import time
+import tracemalloc
+from mef_mooc import create_app
+from mef_mooc.scripts.models import db
+
+SHAPES = {
+    "/admin/moocs": """
+        SELECT g as id, 'MOOC ' || g as name, 'https://example.com/' || g as url,
+               (g %% 40)::float as average_hours, true as is_active
+        FROM generate_series(1, %s) g
+    """,
+    "/admin/students": """
+        SELECT g as id, 'Name ' || g as name, 'Surname ' || g as surname, 'student' || g || '@mef.edu.tr' as email,
+               (041900000 + g)::text as student_no, 'Computer Engineering' as department_name
+        FROM generate_series(1, %s) g
+    """,
+    "semester report": """
+        SELECT g as student_id, g as enrollment_id, 'COMP' as department, 'MOOC ' || g as moocs,
+               (g %% 40)::float as average_hours, 'https://coursera.org/verify/' || g as certificate_url,
+               'Name ' || g || ' Surname' as student_name, NULL::text as comment
+        FROM generate_series(1, %s) g
+    """,
+}
+
+def measure(app, fetch, query, rows):
+    with app.app_context():
+        tracemalloc.start()
+        started_at = time.perf_counter()
+        body = app.json.dumps({"rows": fetch(query, (rows,))})
+        elapsed = time.perf_counter() - started_at
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak, len(body)
+
+def main(row_counts):
+    app = create_app()
+    print("%-18s %8s %-10s %10s %12s" % ("shape", "rows", "mode", "ms", "peak KiB"))
+    for name, query in SHAPES.items():
+        for rows in row_counts:
+            for mode, fetch in (("dict", db.fetch), ("tuple", db.fetch_rows)):
+                elapsed, peak, _ = measure(app, fetch, query, rows)
+                print("%-18s %8d %-10s %10.1f %12.0f" % (name, rows, mode, elapsed * 1000, peak / 1024))
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]] or [10000, 100000])
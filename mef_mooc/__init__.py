@@ -5,7 +5,9 @@ from mef_mooc.student.students import student_app
 from mef_mooc.general.general import general_app
 from mef_mooc.admin.admin import admin_app
 from mef_mooc.coordinator.coordinators import coordinator_app
-from mef_mooc.scripts.extensions import jwt, bcrypt
+from mef_mooc.scripts.extensions import jwt, bcrypt, invalidation, MoocJSONProvider
+from mef_mooc.scripts.models import db
+from mef_mooc.scripts import profiling
 
 def create_app():
     app = Flask(__name__)
@@ -15,9 +17,13 @@ def create_app():
     app.register_blueprint(coordinator_app)
 
     app.config.from_pyfile('config.py')
+    app.json = MoocJSONProvider(app)
     CORS(app)
 
     jwt.init_app(app)
     bcrypt.init_app(app)
+    db.init_app(app)
+    profiling.init_app(app)
+    invalidation.start()
 
     return app
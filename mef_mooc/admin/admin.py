@@ -7,10 +7,13 @@ import string
 from mef_mooc.scripts.auth import admin_auth
 from mef_mooc.scripts.models import db
 from mef_mooc.scripts.util import (SEMESTERS, create_random_password, student_invite_mail_queue, 
-                                   send_mail_queue, db_exec_queue)
-from mef_mooc.scripts.constants import FRONTEND_URL
-from mef_mooc.config import ADMIN_USERNAME, ADMIN_PASSWORD, JWT_ACCESS_TOKEN_EXPIRES
-from mef_mooc.scripts.extensions import jwt_redis_blocklist
+                                   send_mail_queue, db_exec_queue, stream_json_response)
+from mef_mooc.config import ADMIN_USERNAME, ADMIN_PASSWORD
+from mef_mooc.scripts.extensions import revoke_token
+from mef_mooc.scripts.ownership import invalidate_coordinators
+from mef_mooc.scripts.token_versions import bump_token_versions
+from mef_mooc.scripts.catalog import catalog_response, bump_catalog_version
+from mef_mooc.scripts.jobs import create_job, update_job, get_job, run_job, hash_passwords
 
 admin_app = Blueprint('admin_app', __name__, url_prefix='/admin')
 
@@ -35,48 +38,73 @@ def admin_login():
 @admin_auth()
 def admin_logout():
     try:
-        jti = get_jwt()['jti']
-        jwt_redis_blocklist.set(jti, '', JWT_ACCESS_TOKEN_EXPIRES)
+        revoke_token(get_jwt())
         return {"message": "Successfully logged out"}, 200
     except Exception as e:
         print(e)
         return {"message": "Something went wrong"}, 500
 
+def invite_students_job(job_id, new_students, passwords):
+    hashed_passwords = hash_passwords(passwords, on_progress=lambda done: update_job(job_id, done=done))
+    update_job(job_id, done=len(hashed_passwords))
+
+    rows = [(email, hashed_password, student_no, name, surname, department_id)
+            for (email, student_no, name, surname, department_id), hashed_password in zip(new_students, hashed_passwords)]
+    with db.transaction():
+        db.insert_many("student", ("email", "password", "student_no", "name", "surname", "department_id"), rows,
+                       on_conflict="(student_no) DO NOTHING")
+        student_invite_mail_queue([{'email': student[0], 'password': password} for student, password in zip(new_students, passwords)])
+
 @admin_app.route("/invite-students", methods=['POST'])
 @admin_auth()
 def invite_students():
     try:
         data = request.get_json()
         students = data['students']
-        student_mail_list = list()
+        new_students = list()
+        passwords = list()
+        reinvited_students = list()
+
+        existing_students = db.fetch("SELECT email, student_no FROM student WHERE email = ANY(%s) OR student_no = ANY(%s)",
+                                     ([student['email'] for student in students], [str(student['student_no']) for student in students]))
+        existing_emails = {student['email'] for student in existing_students}
+        existing_student_nos = {student['student_no'] for student in existing_students}
 
-        query = "INSERT INTO student (email, password, student_no, name, surname, department_id) VALUES "
         for student in students:
             email = student['email']
-            password = create_random_password()
-            student_no = str(student['student_no'])            
-            name = student['name'].replace("'", "''")
-            surname = student['surname'].replace("'", "''")
-            department_id = student['department_id']
-
-            student = db.fetch_one("SELECT * FROM student WHERE email = %s OR student_no = %s", (email, student_no))
-            if student:
-                send_mail_queue(email, "MEF MOOC Invitation", f"You have been invited to MEF MOOC.\n{FRONTEND_URL}\n\nYou can login with your email and password.")
+            student_no = str(student['student_no'])
+
+            if email in existing_emails or student_no in existing_student_nos:
+                reinvited_students.append({'email': email})
                 continue
 
-            hashed_password = generate_password_hash(password).decode('utf-8')
-            
-            query += f"('{email}', '{hashed_password}', '{student_no}', '{name}', '{surname}', {department_id}), "
+            # Same student listed twice in one upload
+            existing_emails.add(email)
+            existing_student_nos.add(student_no)
+
+            new_students.append((email, student_no, student['name'], student['surname'], student['department_id']))
+            passwords.append(create_random_password())
+
+        # One outbox write for the whole upload, not one insert and NOTIFY per existing student
+        student_invite_mail_queue(reinvited_students)
+
+        # Hashing runs on the hashing thread pool in the background, the admin polls the job for progress
+        job_id = create_job("invite-students", len(new_students))
+        run_job(job_id, invite_students_job, new_students, passwords)
+        return {"message": "Students are being invited", "job_id": job_id}, 202
+    except Exception as e:
+        print(e)
+        return {"message": "An error occured"}, 500
 
-            student_mail_list.append({
-                'email': email,
-                'password': password,
-            })
+@admin_app.route("/jobs/<job_id>", methods=['GET'])
+@admin_auth()
+def get_job_status(job_id):
+    try:
+        job = get_job(job_id)
+        if not job:
+            return {"message": "Job not found"}, 404
 
-        query = query[:-2]
-        db.execute(query)
-        student_invite_mail_queue(student_mail_list)
-        return {"message": "Students invited"}, 200
+        return {"job": job}, 200
     except Exception as e:
         print(e)
         return {"message": "An error occured"}, 500
@@ -96,9 +124,9 @@ def add_coordinator():
             return {"message": "Coordinator already exists"}, 400
 
         hashed_password = generate_password_hash(password).decode('utf-8')
-        db.execute("INSERT INTO coordinator (name, surname, email, password) VALUES (%s, %s, %s, %s)", (name, surname, email, hashed_password))
-
-        send_mail_queue(email, "MEF MOOC Coordinator Account", f"You have been invited to MEF MOOC as a coordinator.\n{FRONTEND_URL}\n\nYou can login with your email and password.\nYour password is {password}")
+        with db.transaction():
+            db.execute("INSERT INTO coordinator (name, surname, email, password) VALUES (%s, %s, %s, %s)", (name, surname, email, hashed_password))
+            send_mail_queue(email, "coordinator_invitation", {"password": password})
 
         return {"message": f"Coordinator added successfully."}, 200
     except Exception as e:
@@ -121,6 +149,7 @@ def change_student_profile(student_id):
         department_id = data['department_id']
 
         db.execute("UPDATE student SET name = %s, surname = %s, email = %s, student_no = %s, department_id = %s WHERE id = %s", (name, surname, email, student_no, department_id, student_id))
+        bump_token_versions('student', student_id)
 
         return {"message": "Student updated"}, 200
     except Exception as e:
@@ -141,6 +170,7 @@ def change_coordinator_profile(coordinator_id):
         email = data['email']
 
         db.execute("UPDATE coordinator SET name = %s, surname = %s, email = %s WHERE id = %s", (name, surname, email, coordinator_id))
+        bump_token_versions('coordinator', coordinator_id)
 
         return {"message": "Coordinator updated"}, 200
     except Exception as e:
@@ -174,6 +204,7 @@ def delete_coordinator(coordinator_id):
             return {"message": "You cannot delete this coordinator"}, 400
 
         db.execute("UPDATE coordinator SET is_active = False WHERE id = %s", (coordinator_id,))
+        bump_token_versions('coordinator', coordinator_id)
 
         return {"message": "Coordinator deleted successfully"}, 200
     except Exception as e:
@@ -210,8 +241,11 @@ def add_department():
         if not coordinator:
             return {"message": "Coordinator not found"}, 404
 
-        db.execute("UPDATE coordinator SET is_active = True WHERE id = %s", (coordinator_id,))
-        db.execute("INSERT INTO department (name, coordinator_id, code) VALUES (%s, %s, %s)", (name, coordinator_id, code,))
+        with db.transaction():
+            db.execute("UPDATE coordinator SET is_active = True WHERE id = %s", (coordinator_id,))
+            db.execute("INSERT INTO department (name, coordinator_id, code) VALUES (%s, %s, %s)", (name, coordinator_id, code,))
+        invalidate_coordinators(coordinator_id)
+        bump_token_versions('coordinator', coordinator_id)
 
         return {"message": "Department added successfully"}, 200
     except Exception as e:
@@ -243,11 +277,14 @@ def change_coordinator(department_id):
         if not coordinator:
             return {"message": "Coordinator not found"}, 404
 
-        if department['coordinator_id']:
-            db.execute("UPDATE coordinator SET is_active = False WHERE id = %s", (department['coordinator_id'],))
+        with db.transaction():
+            if department['coordinator_id']:
+                db.execute("UPDATE coordinator SET is_active = False WHERE id = %s", (department['coordinator_id'],))
 
-        db.execute("UPDATE coordinator SET is_active = True WHERE id = %s", (coordinator_id,))
-        db.execute("UPDATE department SET coordinator_id = %s WHERE id = %s", (coordinator_id, department_id))
+            db.execute("UPDATE coordinator SET is_active = True WHERE id = %s", (coordinator_id,))
+            db.execute("UPDATE department SET coordinator_id = %s WHERE id = %s", (coordinator_id, department_id))
+        invalidate_coordinators(department['coordinator_id'], coordinator_id)
+        bump_token_versions('coordinator', department['coordinator_id'], coordinator_id)
         return {"message": "Coordinator changed successfully"}, 200
     except Exception as e:
         print(e)
@@ -263,7 +300,7 @@ def get_students():
         except:
             student_no = ""
 
-        students = db.fetch(f"""
+        students = db.fetch_rows(f"""
                             SELECT student.id, student.name, student.surname, student.email, student.student_no, department.name as department_name 
                             FROM student 
                             LEFT JOIN department ON student.department_id = department.id
@@ -314,11 +351,7 @@ def get_coordinator(coordinator_id):
 @admin_auth()
 def get_moocs():
     try:
-        moocs = db.fetch("""
-                        SELECT mooc.id, mooc.name, mooc.url, mooc.average_hours, is_active 
-                        FROM mooc
-                        """)
-        return {"moocs": moocs}, 200
+        return catalog_response('all')
     except Exception as e:
         print(e)
         return {"message": "An error occured"}, 500
@@ -334,8 +367,12 @@ def add_moocs():
             return {"message": "Moocs not found"}, 404
 
         incorrect_moocs = []
+        new_moocs = []
+
+        existing_moocs = db.fetch("SELECT name, url FROM mooc WHERE (name, url) IN (SELECT * FROM unnest(%s::text[], %s::text[]))",
+                                  ([str(mooc.get('name')) for mooc in moocs], [str(mooc.get('url')) for mooc in moocs]))
+        existing_moocs = {(mooc['name'], mooc['url']) for mooc in existing_moocs}
 
-        query = "INSERT INTO mooc (name, url, average_hours) VALUES "
         mooc_check_count = 0
         for mooc in moocs:
             
@@ -363,18 +400,18 @@ def add_moocs():
                 incorrect_moocs.append(mooc['name'])
                 continue
 
-            mooc_check = db.fetch_one("SELECT * FROM mooc WHERE name = %s and url = %s LIMIT 1", (mooc['name'], mooc['url']))
-            if mooc_check:
+            if (mooc['name'], mooc['url']) in existing_moocs:
                 mooc_check_count += 1
                 continue
-            
-            query += f"('{mooc['name']}', '{mooc['url']}', {mooc['average_hours']}),"
+
+            existing_moocs.add((mooc['name'], mooc['url']))
+            new_moocs.append((mooc['name'], mooc['url'], mooc['average_hours']))
 
         if mooc_check_count == len(moocs):
             return {"message": "All moocs already exists"}, 400
         
-        query = query[:-1]
-        db.execute(query)
+        db.insert_many("mooc", ("name", "url", "average_hours"), new_moocs)
+        bump_catalog_version()
 
         if incorrect_moocs:
             report = "Following moocs are not added because of missing data: "
@@ -420,6 +457,7 @@ def update_mooc(mooc_id):
             return {"message": "MOOC not found"}, 404
         
         db.execute("UPDATE mooc SET name = %s, url = %s, average_hours = %s WHERE id = %s", (name, url, average_hours, mooc_id))
+        bump_catalog_version()
 
         return {"message": "MOOC updated successfully"}, 200
     except Exception as e:
@@ -442,6 +480,7 @@ def delete_mooc(mooc_id):
         else:
             return {"message": "An error occured"}, 500
 
+        bump_catalog_version()
         return {"message": "MOOC status changed successfully"}, 200
     except Exception as e:
         print(e)
@@ -472,7 +511,7 @@ def get_semester_report(semester):
         if semester not in SEMESTERS:
             return {"message": "Semester not found"}, 404
         
-        semester_report = db.fetch("""
+        semester_report = db.stream("""
                         SELECT s.id as student_id, e.id as enrollment_id, d.code as department, m.name as moocs, m.average_hours, 
                                bd.certificate_url, CONCAT(s.name, ' ', s.surname) as student_name, b.comment
                         FROM student s
@@ -485,7 +524,7 @@ def get_semester_report(semester):
                         WHERE b.status = 'Accepted Certificates' and c.semester = %s
                         """, (semester,))
         
-        return {"semester_report": semester_report}, 200
+        return stream_json_response("semester_report", semester_report)
     
     except Exception as e:
         print(e)
@@ -1,4 +1,5 @@
 from dotenv import load_dotenv, find_dotenv
+import os
 from os import getenv
 
 try:
@@ -14,6 +15,12 @@ DATABASE_NAME = getenv('DATABASE_NAME')
 DATABASE_USER = getenv('DATABASE_USER')
 DATABASE_PASSWORD = getenv('DATABASE_PASSWORD')
 DATABASE_PORT = getenv('DATABASE_PORT')
+DATABASE_POOL_MIN = int(getenv('DATABASE_POOL_MIN', 1))
+DATABASE_POOL_MAX = int(getenv('DATABASE_POOL_MAX', 20))
+DATABASE_POOL_TIMEOUT = float(getenv('DATABASE_POOL_TIMEOUT', 5))
+
+QUERY_PROFILING = getenv('QUERY_PROFILING', 'False').lower() == 'true'
+QUERY_REPEAT_THRESHOLD = int(getenv('QUERY_REPEAT_THRESHOLD', 3))
 
 ADMIN_USERNAME = getenv('ADMIN_USERNAME')
 ADMIN_PASSWORD = getenv('ADMIN_PASSWORD')
@@ -21,15 +28,41 @@ ADMIN_PASSWORD = getenv('ADMIN_PASSWORD')
 JWT_ACCESS_TOKEN_EXPIRES = int(getenv('JWT_ACCESS_TOKEN_EXPIRES'))
 JWT_SECRET_KEY = getenv('JWT_SECRET_KEY')
 
+PASSWORD_HASH_WORKERS = int(getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+
 SMTP_SERVER = getenv('SMTP_SERVER')
 SMTP_PORT = getenv('SMTP_PORT')
 SMTP_USERNAME = getenv('SMTP_USERNAME')
 SMTP_PASSWORD = getenv('SMTP_PASSWORD')
+# smtp, or capture to keep mails in memory instead of sending them
+SMTP_BACKEND = getenv('SMTP_BACKEND', 'smtp')
+SMTP_SENDER = getenv('SMTP_SENDER', SMTP_USERNAME)
+SMTP_STARTTLS = getenv('SMTP_STARTTLS', 'True').lower() == 'true'
+SMTP_TIMEOUT = float(getenv('SMTP_TIMEOUT', 30))
 
 RABBITMQ_HOST = getenv('RABBITMQ_HOST')
+# rabbitmq, or memory for an in-process broker
+BROKER_BACKEND = getenv('BROKER_BACKEND', 'rabbitmq')
+MAIL_WORKERS = int(getenv('MAIL_WORKERS', 8))
+MAIL_PREFETCH = int(getenv('MAIL_PREFETCH', 16))
+# Mails per second, 0 for no limit
+MAIL_RATE = float(getenv('MAIL_RATE', 0))
+MAIL_BULK_WORKERS = int(getenv('MAIL_BULK_WORKERS', 4))
+MAIL_BULK_PREFETCH = int(getenv('MAIL_BULK_PREFETCH', 8))
+MAIL_BULK_RATE = float(getenv('MAIL_BULK_RATE', 10))
+# Seconds, 0 turns the feature off
+MAIL_DEDUP_WINDOW = int(getenv('MAIL_DEDUP_WINDOW', 3600))
+MAIL_DIGEST_WINDOW = int(getenv('MAIL_DIGEST_WINDOW', 0))
+# One session for every mail worker of both lanes
+SMTP_POOL_SIZE = int(getenv('SMTP_POOL_SIZE', MAIL_WORKERS + MAIL_BULK_WORKERS))
+DB_EXEC_BATCH_SIZE = int(getenv('DB_EXEC_BATCH_SIZE', 500))
+DB_EXEC_BATCH_WAIT = float(getenv('DB_EXEC_BATCH_WAIT', 0.2))
+OUTBOX_BATCH_SIZE = int(getenv('OUTBOX_BATCH_SIZE', 500))
+OUTBOX_POLL_INTERVAL = float(getenv('OUTBOX_POLL_INTERVAL', 5))
 
 REDIS_HOST = getenv('REDIS_HOST')
 REDIS_PORT = int(getenv('REDIS_PORT'))
 REDIS_DB = int(getenv('REDIS_DB'))
+REDIS_SOCKET_TIMEOUT = float(getenv('REDIS_SOCKET_TIMEOUT', 5))
 
 
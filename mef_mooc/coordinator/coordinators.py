@@ -1,11 +1,13 @@
 from flask import Blueprint, request
 from flask_jwt_extended import create_access_token, get_jwt
 from flask_bcrypt import check_password_hash, generate_password_hash
-from mef_mooc.scripts.util import SEMESTERS, BUNDLE_STATUS, create_random_password, send_mail_queue
-from mef_mooc.scripts.auth import coordinator_auth
-from mef_mooc.scripts.models import db
-from mef_mooc.scripts.extensions import jwt_redis_blocklist
-from mef_mooc.config import JWT_ACCESS_TOKEN_EXPIRES
+from mef_mooc.scripts.util import SEMESTERS, BUNDLE_STATUS, create_random_password, send_mail_queue, stream_json_response
+from mef_mooc.scripts.auth import coordinator_auth, current_coordinator, current_department
+from mef_mooc.scripts.models import db, async_db
+from mef_mooc.scripts.ownership import get_course_department_id
+from mef_mooc.scripts.extensions import revoke_token
+from mef_mooc.scripts.token_versions import bump_token_versions
+from mef_mooc.scripts.catalog import catalog_response
 
 coordinator_app = Blueprint('coordinator_app', __name__, url_prefix='/coordinator')
 
@@ -16,7 +18,12 @@ def coordinator_login():
         email = data['email']
         password = data['password']
 
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE email = %s and is_active = True LIMIT 1", (email,))
+        coordinator = db.fetch_one("""
+                                    SELECT c.*, d.id as department_id
+                                    FROM coordinator c
+                                    LEFT JOIN department d ON d.coordinator_id = c.id
+                                    WHERE c.email = %s and c.is_active = True LIMIT 1
+                                    """, (email,))
         if not coordinator:
             return {"message": "Invalid credentials or coordinator disabled"}, 401
 
@@ -25,7 +32,9 @@ def coordinator_login():
 
         token_identity = {
             'type': 'coordinator',
-            'id': coordinator['id']
+            'id': coordinator['id'],
+            'department_id': coordinator['department_id'],
+            'token_version': coordinator['token_version']
         }
 
         access_token = create_access_token(identity=token_identity)
@@ -38,8 +47,7 @@ def coordinator_login():
 @coordinator_auth()
 def coordinator_logout():
     try:
-        jti = get_jwt()['jti']
-        jwt_redis_blocklist.set(jti, "", JWT_ACCESS_TOKEN_EXPIRES)
+        revoke_token(get_jwt())
         return {"message": "Logged out successfully"}, 200
     except Exception as e:
         print(e)
@@ -58,13 +66,10 @@ def coordinator_forgot_password():
         password = create_random_password()
         hashed_password = generate_password_hash(password).decode('utf-8')
 
-        db.execute("UPDATE coordinator SET password = %s WHERE id = %s", (hashed_password, coordinator['id']))
-
-        send_mail_queue(
-            email,
-            "MEF MOOC Password Reset",
-            "Your MEF MOOC password reset succesfully.\nNew password: " + password
-        )
+        with db.transaction():
+            db.execute("UPDATE coordinator SET password = %s WHERE id = %s", (hashed_password, coordinator['id']))
+            send_mail_queue(email, "password_reset", {"password": password})
+        bump_token_versions('coordinator', coordinator['id'])
 
         return {"message": "Password reset successfully"}, 200
     except Exception as e:
@@ -79,10 +84,7 @@ def coordinator_change_password():
         old_password = data['old_password']
         new_password = data['new_password']
 
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
+        coordinator = current_coordinator()
 
         if not check_password_hash(coordinator['password'], old_password):
             return {"message": "Invalid credentials"}, 401
@@ -90,7 +92,10 @@ def coordinator_change_password():
         hashed_password = generate_password_hash(new_password).decode('utf-8')
         db.execute("UPDATE coordinator SET password = %s WHERE id = %s", (hashed_password, coordinator['id']))
 
-        return {"message": "Password changed successfully"}, 200
+        # Other sessions are logged out by the new version, this one continues with a fresh token
+        token_identity = dict(get_jwt()['sub'], token_version=bump_token_versions('coordinator', coordinator['id'])[coordinator['id']])
+        access_token = create_access_token(identity=token_identity)
+        return {"message": "Password changed successfully", "access_token": access_token}, 200
     except Exception as e:
         print(e)
         return {"message": "An error occured"}, 500
@@ -99,13 +104,9 @@ def coordinator_change_password():
 @coordinator_auth()
 def coordinator_profile():
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
+        coordinator = current_coordinator()
         
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator['id'],))
+        department = current_department()
         if not department:
             return {"message": "Department not found"}, 404
         
@@ -123,12 +124,6 @@ def coordinator_profile():
 @coordinator_auth()
 def coordinator_possible_semesters():
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
         return {"semesters": SEMESTERS}, 200
     except Exception as e:
         print(e)
@@ -139,23 +134,18 @@ def coordinator_possible_semesters():
 @coordinator_auth()
 def coordinator_course_info(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
-        if not course:
+        course_department_id = get_course_department_id(course_id)
+        if not course_department_id:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE id = %s LIMIT 1", (course['department_id'],))
+        department = current_department()
         if not department:
             return {"message": "Department not found"}, 404
 
-        if department['coordinator_id'] != coordinator['id']:
+        if course_department_id != department['id']:
             return {"message": "You are not allowed to see this course"}, 403
 
+        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         return {"course": course}, 200
     except Exception as e:
         print(e)
@@ -166,17 +156,10 @@ def coordinator_course_info(course_id):
 def coordinator_add_course():
     try:
         coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
 
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator['id'],))
+        department = current_department()
         if not department:
             return {"message": "Department not found or department disabled"}, 404
-        
-        if department['coordinator_id'] != coordinator['id']:
-            return {"message": "You are not allowed to add course to this department"}, 403
 
         data = request.get_json()
         course_code = data['course_code']
@@ -204,17 +187,11 @@ def coordinator_add_course():
 @coordinator_auth()
 def coordinator_passive_course(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s and is_active = True LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator['id'],))
+        department = current_department()
         if not department:
             return {"message": "Department not found or department disabled"}, 404
 
@@ -232,19 +209,10 @@ def coordinator_passive_course(course_id):
 @coordinator_auth()
 def coordinator_active_courses():
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator['id'],))
+        department = current_department()
         if not department:
             return {"message": "Department not found or department disabled"}, 404
 
-        if department['coordinator_id'] != coordinator['id']:
-            return {"message": "You are not allowed to see this course"}, 403
-
         courses = db.fetch("SELECT * FROM MEFcourse WHERE department_id = %s and is_active = True", (department['id'],))
         return {"courses": courses}, 200
     except Exception as e:
@@ -255,13 +223,7 @@ def coordinator_active_courses():
 @coordinator_auth()
 def coordinator_inactive_courses():
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator['id'],))
+        department = current_department()
         if not department:
             return {"message": "Department not found or department disabled"}, 404
 
@@ -275,19 +237,13 @@ def coordinator_inactive_courses():
 @coordinator_auth()
 def coordinator_waiting_students(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
-        if not course:
+        course_department_id = get_course_department_id(course_id)
+        if not course_department_id:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if course['department_id'] != department['id']:
+        if course_department_id != department['id']:
             return {"message": "You cannot view this course"}, 400
 
         students = db.fetch("""
@@ -311,19 +267,13 @@ def coordinator_waiting_students(course_id):
 @coordinator_auth()
 def coordinator_accept_waiting_students(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
-        if not course:
+        course_department_id = get_course_department_id(course_id)
+        if not course_department_id:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if course['department_id'] != department['id']:
+        if course_department_id != department['id']:
             return {"message": "You cannot view this course"}, 400
 
         data = request.get_json()
@@ -347,17 +297,11 @@ def coordinator_accept_waiting_students(course_id):
 @coordinator_auth()
 def coordinator_reject_waiting_students(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
@@ -374,13 +318,9 @@ def coordinator_reject_waiting_students(course_id):
         if not is_waiting_enrollment:
             return {"message": "Student is not waiting for this course"}, 400
         
-        db.execute("DELETE FROM enrollment WHERE student_id = %s and course_id = %s", (student_id, course_id))
-
-        try:
-            send_mail_queue(student['email'], "Course Enrollment", 
-                            f"Your enrollment request for {course['name']} has been rejected by MOOC Coordinator.\n\nCoordinator Message: {coordinator_message}")
-        except:
-            pass
+        with db.transaction():
+            db.execute("DELETE FROM enrollment WHERE student_id = %s and course_id = %s", (student_id, course_id))
+            send_mail_queue(student['email'], "enrollment_rejected", {"course_name": course['name'], "message": coordinator_message})
         
         return {"message": "Student rejected"}, 200
     except Exception as e:
@@ -391,19 +331,13 @@ def coordinator_reject_waiting_students(course_id):
 @coordinator_auth()
 def coordinator_course(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
-        if not course:
+        course_department_id = get_course_department_id(course_id)
+        if not course_department_id:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if course['department_id'] != department['id']:
+        if course_department_id != department['id']:
             return {"message": "You cannot view this course"}, 400
 
         students = db.fetch("""
@@ -466,15 +400,7 @@ def coordinator_course(course_id):
 @coordinator_auth()
 def coordinator_moocs():
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        moocs = db.fetch("SELECT id, average_hours, name, url FROM mooc WHERE is_active = True")
-
-        return {"moocs": moocs}, 200
+        return catalog_response('active')
     except Exception as e:
         print(e)
         return {"message": "An error occured"}, 500
@@ -483,19 +409,13 @@ def coordinator_moocs():
 @coordinator_auth()
 def coordinator_course_bundle(course_id, bundle_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
-        if not course:
+        course_department_id = get_course_department_id(course_id)
+        if not course_department_id:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if course['department_id'] != department['id']:
+        if course_department_id != department['id']:
             return {"message": "You cannot view this course"}, 400
 
         bundle = db.fetch("""
@@ -520,14 +440,8 @@ def coordinator_course_bundle(course_id, bundle_id):
 @coordinator_auth()
 def coordinator_update_mooc(course_id, bundle_id, bundle_detail_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
-        if not course:
+        course_department_id = get_course_department_id(course_id)
+        if not course_department_id:
             return {"message": "Course not found"}, 404
         
         bundle = db.fetch_one("SELECT * FROM bundle WHERE id = %s LIMIT 1", (bundle_id,))
@@ -538,9 +452,9 @@ def coordinator_update_mooc(course_id, bundle_id, bundle_detail_id):
         if not bundle_detail:
             return {"message": "Bundle detail not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if course['department_id'] != department['id']:
+        if course_department_id != department['id']:
             return {"message": "You cannot view this course"}, 400
 
         data = request.get_json()
@@ -561,14 +475,8 @@ def coordinator_update_mooc(course_id, bundle_id, bundle_detail_id):
 @coordinator_auth()
 def coordinator_update_certificate(course_id, bundle_id, bundle_detail_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
-        if not course:
+        course_department_id = get_course_department_id(course_id)
+        if not course_department_id:
             return {"message": "Course not found"}, 404
         
         bundle = db.fetch_one("SELECT * FROM bundle WHERE id = %s LIMIT 1", (bundle_id,))
@@ -579,9 +487,9 @@ def coordinator_update_certificate(course_id, bundle_id, bundle_detail_id):
         if not bundle_detail:
             return {"message": "Bundle detail not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if course['department_id'] != department['id']:
+        if course_department_id != department['id']:
             return {"message": "You cannot view this course"}, 400
 
         data = request.get_json()
@@ -598,14 +506,8 @@ def coordinator_update_certificate(course_id, bundle_id, bundle_detail_id):
 @coordinator_auth()
 def coordinator_delete_mooc(course_id, bundle_id, bundle_detail_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
-        if not course:
+        course_department_id = get_course_department_id(course_id)
+        if not course_department_id:
             return {"message": "Course not found"}, 404
         
         bundle = db.fetch_one("SELECT * FROM bundle WHERE id = %s LIMIT 1", (bundle_id,))
@@ -616,9 +518,9 @@ def coordinator_delete_mooc(course_id, bundle_id, bundle_detail_id):
         if not bundle_detail:
             return {"message": "Bundle detail not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if course['department_id'] != department['id']:
+        if course_department_id != department['id']:
             return {"message": "You cannot view this course"}, 400
         
         number_of_mooc = db.fetch_one("SELECT COUNT(*) FROM bundle_detail WHERE bundle_id = %s", (bundle_id,))['count']
@@ -636,23 +538,17 @@ def coordinator_delete_mooc(course_id, bundle_id, bundle_detail_id):
 @coordinator_auth()
 def coordinator_add_mooc(course_id, bundle_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
-        if not course:
+        course_department_id = get_course_department_id(course_id)
+        if not course_department_id:
             return {"message": "Course not found"}, 404
         
         bundle = db.fetch_one("SELECT * FROM bundle WHERE id = %s LIMIT 1", (bundle_id,))
         if not bundle:
             return {"message": "Bundle not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if course['department_id'] != department['id']:
+        if course_department_id != department['id']:
             return {"message": "You cannot view this course"}, 400
         
         data = request.get_json()
@@ -678,23 +574,17 @@ def coordinator_add_mooc(course_id, bundle_id):
 @coordinator_auth()
 def coordinator_update_comment(course_id, bundle_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
-        if not course:
+        course_department_id = get_course_department_id(course_id)
+        if not course_department_id:
             return {"message": "Course not found"}, 404
         
         bundle = db.fetch_one("SELECT * FROM bundle WHERE id = %s LIMIT 1", (bundle_id,))
         if not bundle:
             return {"message": "Bundle not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if course['department_id'] != department['id']:
+        if course_department_id != department['id']:
             return {"message": "You cannot view this course"}, 400
         
         data = request.get_json()
@@ -712,16 +602,12 @@ def coordinator_update_comment(course_id, bundle_id):
 def coordinator_approve_bundle(course_id, bundle_id):
     try:
         coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
 
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
@@ -741,8 +627,9 @@ def coordinator_approve_bundle(course_id, bundle_id):
         if not student:
             return {"message": "Student not found"}, 404
 
-        db.execute("UPDATE bundle SET status = %s, coordinator_id = %s, bundle_date = NOW() WHERE id = %s", (BUNDLE_STATUS['waiting-certificates'], coordinator["id"], bundle_id))
-        send_mail_queue(student['email'], "Bundle Approved", f"Your bundle for {course['name']} has been approved. You can start your courses.")
+        with db.transaction():
+            db.execute("UPDATE bundle SET status = %s, coordinator_id = %s, bundle_date = NOW() WHERE id = %s", (BUNDLE_STATUS['waiting-certificates'], coordinator_id, bundle_id))
+            send_mail_queue(student['email'], "bundle_approved", {"course_name": course['name']})
         return {"message": "Bundle approved"}, 200
     except Exception as e:
         print(e)
@@ -753,16 +640,12 @@ def coordinator_approve_bundle(course_id, bundle_id):
 def coordinator_reject_bundle(course_id, bundle_id):
     try:
         coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
 
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
@@ -783,8 +666,9 @@ def coordinator_reject_bundle(course_id, bundle_id):
         data = request.get_json()
         reason = data["reason"]
 
-        db.execute("UPDATE bundle SET status = %s, coordinator_id = %s, bundle_date = NOW(), reject_status_comment = %s WHERE id = %s", (BUNDLE_STATUS['rejected-bundles'], coordinator["id"], reason, bundle_id))
-        send_mail_queue(student["email"], "Bundle Rejected", f"Your bundle for {course['name']} has been rejected.\nReason: " + reason)
+        with db.transaction():
+            db.execute("UPDATE bundle SET status = %s, coordinator_id = %s, bundle_date = NOW(), reject_status_comment = %s WHERE id = %s", (BUNDLE_STATUS['rejected-bundles'], coordinator_id, reason, bundle_id))
+            send_mail_queue(student["email"], "bundle_rejected", {"course_name": course['name'], "reason": reason})
         return {"message": "Bundle rejected"}, 200
     except Exception as e:
         print(e)
@@ -795,16 +679,12 @@ def coordinator_reject_bundle(course_id, bundle_id):
 def coordinator_approve_certificate(course_id, bundle_id):
     try:
         coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
 
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
@@ -824,9 +704,11 @@ def coordinator_approve_certificate(course_id, bundle_id):
         if not student:
             return {"message": "Student not found"}, 404
         
-        db.execute("UPDATE enrollment SET is_pass = True, pass_date = NOW() WHERE id = %s", (enrollment['id'],))
-        db.execute("UPDATE bundle SET status = %s, certificate_coordinator = %s, certificate_date = NOW() WHERE id = %s", (BUNDLE_STATUS['accepted-certificates'], coordinator_id, bundle_id))
-        send_mail_queue(student['email'], "Course Completition", f"""Your certificates has been approved. You completed the {course["name"]} course succesfully.""")
+        with db.transaction():
+            db.execute("UPDATE enrollment SET is_pass = True, pass_date = NOW() WHERE id = %s", (enrollment['id'],))
+            db.execute("UPDATE bundle SET status = %s, certificate_coordinator = %s, certificate_date = NOW() WHERE id = %s", (BUNDLE_STATUS['accepted-certificates'], coordinator_id, bundle_id))
+            send_mail_queue(student['email'], "certificate_approved", {"course_name": course["name"]})
+
         return {"message": "Certificate approved"}, 200
     except Exception as e:
         print(e)
@@ -837,16 +719,12 @@ def coordinator_approve_certificate(course_id, bundle_id):
 def coordinator_reject_certificate(course_id, bundle_id):
     try:
         coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
 
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
 
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
@@ -869,22 +747,19 @@ def coordinator_reject_certificate(course_id, bundle_id):
         if not student:
             return {"message": "Student not found"}, 404
         
-        db.execute("UPDATE bundle SET status = %s, certificate_coordinator = %s, certificate_date = NOW(), reject_status_comment = %s WHERE id = %s", (BUNDLE_STATUS['rejected-certificates'], coordinator_id, reason, bundle_id))
-
-        # Create copy of bundle with the status of waiting certificates and bundle details
-        db.execute("""INSERT INTO bundle (created_at, coordinator_id, enrollment_id, status, bundle_date, complete_date)
-                      SELECT created_at, coordinator_id, enrollment_id, %s, bundle_date, complete_date
-                      FROM bundle WHERE id = %s"""
-                   ,(BUNDLE_STATUS["waiting-certificates"], bundle['id'],))
-                
-        # Get the new bundle id
-        new_bundle = db.fetch_one("SELECT * FROM bundle WHERE enrollment_id = %s AND status = %s LIMIT 1", (bundle['enrollment_id'], BUNDLE_STATUS['waiting-certificates']))
-
-        bundle_details = db.fetch("SELECT * FROM bundle_detail WHERE bundle_id = %s", (bundle['id'],))
-        for bundle_detail in bundle_details:
-            db.execute("INSERT INTO bundle_detail (bundle_id, mooc_id) SELECT %s, mooc_id FROM bundle_detail WHERE id = %s", (new_bundle['id'], bundle_detail['id'],))
-
-        send_mail_queue(student['email'], "Course Completition", f"""Your certificates for {course["name"]} has been rejected. Please check your certificate URLs.\nReason: {reason}""")
+        with db.transaction():
+            db.execute("UPDATE bundle SET status = %s, certificate_coordinator = %s, certificate_date = NOW(), reject_status_comment = %s WHERE id = %s", (BUNDLE_STATUS['rejected-certificates'], coordinator_id, reason, bundle_id))
+
+            # Create copy of bundle with the status of waiting certificates and bundle details
+            new_bundle = db.fetch_one("""INSERT INTO bundle (created_at, coordinator_id, enrollment_id, status, bundle_date, complete_date)
+                                         SELECT created_at, coordinator_id, enrollment_id, %s, bundle_date, complete_date
+                                         FROM bundle WHERE id = %s
+                                         RETURNING id"""
+                                      ,(BUNDLE_STATUS["waiting-certificates"], bundle['id'],))
+
+            db.execute("INSERT INTO bundle_detail (bundle_id, mooc_id) SELECT %s, mooc_id FROM bundle_detail WHERE bundle_id = %s", (new_bundle['id'], bundle['id'],))
+            send_mail_queue(student['email'], "certificate_rejected", {"course_name": course["name"], "reason": reason})
+
         return {"message": "Certificate rejected"}, 200
     except Exception as e:
         print(e)
@@ -892,20 +767,14 @@ def coordinator_reject_certificate(course_id, bundle_id):
     
 @coordinator_app.route("/course/<int:course_id>/waiting-bundles", methods=['GET'])
 @coordinator_auth()
-def coordinator_course_waiting_bundles(course_id):
+async def coordinator_course_waiting_bundles(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
+        course = await async_db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
-
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
 
@@ -915,7 +784,7 @@ def coordinator_course_waiting_bundles(course_id):
             return {"message": "Status not found"}, 404
 
         # TODO: Get total bundle hours
-        bundles = db.fetch("""
+        bundles = await async_db.fetch("""
                             SELECT s.id as student_id, s.name as student_name, s.surname as student_surname, s.email as student_email, 
                                    s.student_no, b.id as bundle_id, b.created_at as bundle_created_at, m.name as mooc_name, m.url as mooc_url, m.average_hours
                             FROM student s
@@ -935,20 +804,14 @@ def coordinator_course_waiting_bundles(course_id):
     
 @coordinator_app.route("/course/<int:course_id>/rejected-bundles", methods=['GET'])
 @coordinator_auth()
-def coordinator_course_rejected_bundles(course_id):
+async def coordinator_course_rejected_bundles(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
+        department = current_department()
 
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
-
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
+        course = await async_db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
-
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
 
@@ -958,7 +821,7 @@ def coordinator_course_rejected_bundles(course_id):
             return {"message": "Status not found"}, 404
 
         # TODO: Get total bundle hours
-        bundles = db.fetch("""
+        bundles = await async_db.fetch("""
                             SELECT s.id as student_id, s.name as student_name, s.surname as student_surname, s.email as student_email, 
                                    s.student_no, b.id as bundle_id, b.bundle_date as bundle_created_at, m.name as mooc_name,
                                    m.url as mooc_url, CONCAT(c.name, ' ', c.surname) as coordinator_name, b.reject_status_comment
@@ -979,20 +842,14 @@ def coordinator_course_rejected_bundles(course_id):
 
 @coordinator_app.route("/course/<int:course_id>/waiting-certificates", methods=['GET'])
 @coordinator_auth()
-def coordinator_course_waiting_certificates(course_id):
+async def coordinator_course_waiting_certificates(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
+        department = current_department()
 
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
+        course = await async_db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
-
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
 
@@ -1002,7 +859,7 @@ def coordinator_course_waiting_certificates(course_id):
             return {"message": "Status not found"}, 404
 
         # TODO: Get total bundle hours
-        bundles = db.fetch("""
+        bundles = await async_db.fetch("""
                             SELECT s.id as student_id, s.name as student_name, s.surname as student_surname, s.email as student_email, 
                                    s.student_no, b.id as bundle_id, b.bundle_date as bundle_created_at, m.name as mooc_name,
                                    m.url as mooc_url, bd.certificate_url, CONCAT(c.name, ' ', c.surname) as coordinator_name, b.created_at as student_bundle_create_date
@@ -1023,20 +880,14 @@ def coordinator_course_waiting_certificates(course_id):
     
 @coordinator_app.route("/course/<int:course_id>/waiting-approval", methods=['GET'])
 @coordinator_auth()
-def coordinator_course_waiting_approval(course_id):
+async def coordinator_course_waiting_approval(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
+        department = current_department()
 
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
+        course = await async_db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
-
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
 
@@ -1046,7 +897,7 @@ def coordinator_course_waiting_approval(course_id):
             return {"message": "Status not found"}, 404
 
         # TODO: Get total bundle hours
-        bundles = db.fetch("""
+        bundles = await async_db.fetch("""
                             SELECT s.id as student_id, s.name as student_name, s.surname as student_surname, s.email as student_email, 
                                    s.student_no, b.id as bundle_id, b.complete_date, m.name as mooc_name, b.bundle_date, b.created_at as student_bundle_create_date,  
                                    m.url as mooc_url, bd.certificate_url, b.comment, CONCAT(c.name, ' ', c.surname) as bundle_coordinator
@@ -1067,20 +918,14 @@ def coordinator_course_waiting_approval(course_id):
     
 @coordinator_app.route("/course/<int:course_id>/rejected-certificates", methods=['GET'])
 @coordinator_auth()
-def coordinator_course_rejected_certificates(course_id):
+async def coordinator_course_rejected_certificates(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
+        department = current_department()
 
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
+        course = await async_db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
-
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
 
@@ -1090,7 +935,7 @@ def coordinator_course_rejected_certificates(course_id):
             return {"message": "Status not found"}, 404
 
         # TODO: Get total bundle hours
-        bundles = db.fetch("""
+        bundles = await async_db.fetch("""
                             SELECT s.id as student_id, s.name as student_name, s.surname as student_surname, s.email as student_email, 
                                    s.student_no, b.id as bundle_id, b.certificate_date as bundle_created_at, m.name as mooc_name, b.comment,
                                    m.url as mooc_url, bd.certificate_url, CONCAT(c.name, ' ', c.surname) as coordinator_name, b.reject_status_comment
@@ -1111,20 +956,14 @@ def coordinator_course_rejected_certificates(course_id):
     
 @coordinator_app.route("/course/<int:course_id>/accepted-certificates", methods=['GET'])
 @coordinator_auth()
-def coordinator_course_accepted_certificates(course_id):
+async def coordinator_course_accepted_certificates(course_id):
     try:
-        coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
+        department = current_department()
 
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
+        course = await async_db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
-
         if course['department_id'] != department['id']:
             return {"message": "You cannot view this course"}, 400
 
@@ -1134,7 +973,7 @@ def coordinator_course_accepted_certificates(course_id):
             return {"message": "Status not found"}, 404
 
         # TODO: Get total bundle hours
-        bundles = db.fetch("""
+        bundles = await async_db.fetch("""
                             SELECT s.id as student_id, s.name as student_name, s.surname as student_surname, s.email as student_email, 
                                 s.student_no, b.id as bundle_id, b.certificate_date, b.bundle_date, m.name as mooc_name, e.pass_date,
                                 m.url as mooc_url, bd.certificate_url, CONCAT(c.name, ' ', c.surname) as certificate_coordinator, b.comment,
@@ -1160,12 +999,8 @@ def coordinator_course_accepted_certificates(course_id):
 def coordinator_semester_report(semester):
     try:
         coordinator_id = get_jwt()['sub']['id']
-        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
-
-        if not coordinator:
-            return {"message": "Coordinator not found or coordinator disabled"}, 404
         
-        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        department = current_department()
         if not department:
             return {"message": "Department not found"}, 404
 
@@ -1177,7 +1012,7 @@ def coordinator_semester_report(semester):
         if not hashed_status:
             return {"message": "Status not found"}, 404
         
-        bundles = db.fetch("""
+        bundles = db.stream("""
                             SELECT s.id as student_id, CONCAT(s.name, ' ', s.surname) as student_name, s.student_no,
                                     e.id as enrollment_id, m.name as moocs, m.average_hours, c.credits as total_ects, 
                                     c.course_code, c.name as course_name, bd.certificate_url, b.comment
@@ -1192,7 +1027,7 @@ def coordinator_semester_report(semester):
                                 and d.coordinator_id = %s
                             """, (hashed_status, semester, coordinator_id,))
         
-        return {"bundles": bundles}, 200
+        return stream_json_response("bundles", bundles)
     except Exception as e:
         print(e)
         return {"message": "An error occured"}, 500
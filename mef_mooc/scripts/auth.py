@@ -1,38 +1,113 @@
 import functools
+import inspect
+from flask import g
 from flask_jwt_extended import verify_jwt_in_request, get_jwt
+from mef_mooc.scripts.models import db
+from mef_mooc.scripts.ownership import cached_coordinator_department, cache_coordinator_department, get_coordinator_department
+from mef_mooc.scripts.token_versions import get_token_version
+
+DEPARTMENT_PREFIX = 'department_'
+
+def current_student():
+    if 'student' not in g:
+        g.student = db.fetch_one("""
+                                SELECT s.*, d.name as department
+                                FROM student s
+                                LEFT JOIN department d ON d.id = s.department_id
+                                WHERE s.id = %s LIMIT 1
+                                """, (get_jwt()['sub']['id'],))
+    return g.student
+
+def load_coordinator():
+    coordinator_id = get_jwt()['sub']['id']
+    department = cached_coordinator_department(coordinator_id)
+    if department is not None:
+        coordinator = db.fetch_one("SELECT * FROM coordinator WHERE id = %s and is_active = True LIMIT 1", (coordinator_id,))
+        return coordinator, department if coordinator else None
+
+    row = db.fetch_one("""
+                        SELECT c.*, d.id as department_id, d.name as department_name, d.code as department_code,
+                               d.coordinator_id as department_coordinator_id, d.created_at as department_created_at
+                        FROM coordinator c
+                        LEFT JOIN department d ON d.coordinator_id = c.id
+                        WHERE c.id = %s and c.is_active = True LIMIT 1
+                        """, (coordinator_id,))
+    if not row:
+        return None, None
+
+    coordinator = {key: value for key, value in row.items() if not key.startswith(DEPARTMENT_PREFIX)}
+    department = {key[len(DEPARTMENT_PREFIX):]: value for key, value in row.items() if key.startswith(DEPARTMENT_PREFIX)}
+    if department['id'] is None:
+        return coordinator, None
+
+    cache_coordinator_department(coordinator_id, department)
+    return coordinator, department
+
+def current_coordinator():
+    if 'coordinator' not in g:
+        g.coordinator, g.department = load_coordinator()
+    return g.coordinator
+
+def current_department_id():
+    return get_jwt()['sub'].get('department_id')
+
+def current_department():
+    # The department id is signed into the token and the token version changes with it,
+    # so only the department row itself is needed here
+    if 'department' not in g:
+        department_id = current_department_id()
+        g.department = get_coordinator_department(get_jwt()['sub']['id']) if department_id is not None else None
+    return g.department
+
+def check_token_type(token_type):
+    verify_jwt_in_request()
+    claims = get_jwt()
+    if claims['sub']['type'] != token_type:
+        return {"message": "Invalid token [From Decorator]"}, 403
+
+    if token_type == 'admin':
+        return None
+
+    token_version = get_token_version(token_type, claims['sub']['id'])
+    if token_version is None:
+        if token_type == 'student':
+            return {"message": "Student not found"}, 404
+        return {"message": "Coordinator not found or coordinator disabled"}, 404
+
+    if claims['sub'].get('token_version') != token_version:
+        return {"message": "Token has been revoked"}, 401
+
+    return None
+
+def token_type_required(f, token_type):
+    if inspect.iscoroutinefunction(f):
+        @functools.wraps(f)
+        async def async_decorator(*args, **kwargs):
+            error = check_token_type(token_type)
+            if error:
+                return error
+            return await f(*args, **kwargs)
+        return async_decorator
+
+    @functools.wraps(f)
+    def decorator(*args, **kwargs):
+        error = check_token_type(token_type)
+        if error:
+            return error
+        return f(*args, **kwargs)
+    return decorator
 
 def student_auth():
     def wrapper(f):
-        @functools.wraps(f)
-        def decorator(*args, **kwargs):
-            verify_jwt_in_request()
-            claims = get_jwt()
-            if claims['sub']['type'] != 'student':
-                return {"message": "Invalid token [From Decorator]"}, 403
-            return f(*args, **kwargs)
-        return decorator
+        return token_type_required(f, 'student')
     return wrapper
 
 def coordinator_auth():
     def wrapper(f):
-        @functools.wraps(f)
-        def decorator(*args, **kwargs):
-            verify_jwt_in_request()
-            claims = get_jwt()
-            if claims['sub']['type'] != 'coordinator':
-                return {"message": "Invalid token [From Decorator]"}, 403
-            return f(*args, **kwargs)
-        return decorator
+        return token_type_required(f, 'coordinator')
     return wrapper
 
 def admin_auth():
     def wrapper(f):
-        @functools.wraps(f)
-        def decorator(*args, **kwargs):
-            verify_jwt_in_request()
-            claims = get_jwt()
-            if claims['sub']['type'] != 'admin':
-                return {"message": "Invalid token [From Decorator]"}, 403
-            return f(*args, **kwargs)
-        return decorator
-    return wrapper
\ No newline at end of file
+        return token_type_required(f, 'admin')
+    return wrapper
@@ -0,0 +1,108 @@
+import time
+import threading
+from collections import OrderedDict
+import redis
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return default
+
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self.data[key]
+                return default
+
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+class InvalidationListener:
+    def __init__(self, redis_client, retry_interval=1, ping_interval=5, max_silence=15):
+        self.redis = redis_client
+        self.retry_interval = retry_interval
+        self.ping_interval = ping_interval
+        self.max_silence = max_silence
+        self.channels = {}
+        self.thread = None
+        self.heard_at = None
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel, on_message, on_subscribe=None, on_disconnect=None):
+        self.channels[channel] = (on_message, on_subscribe, on_disconnect)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self.listen, name='cache-invalidation', daemon=True)
+            self.thread.start()
+
+    def is_live(self):
+        # A subscription that silently stalled delivers nothing, so only a recent pong proves we are still listening
+        heard_at = self.heard_at
+        return heard_at is not None and time.monotonic() - heard_at <= self.max_silence
+
+    def listen(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(*self.channels)
+                self.heard_at = pinged_at = time.monotonic()
+                # Messages published while we were not subscribed are lost, so local state starts over
+                for _, on_subscribe, _ in self.channels.values():
+                    if on_subscribe:
+                        on_subscribe()
+
+                while True:
+                    message = pubsub.get_message(timeout=self.ping_interval)
+                    now = time.monotonic()
+                    if message is not None:
+                        self.heard_at = now
+                        if message['type'] == 'message':
+                            on_message = self.channels[message['channel']][0]
+                            try:
+                                on_message(message['data'])
+                            except Exception as e:
+                                print(e)
+
+                    if now - self.heard_at > self.max_silence:
+                        raise redis.ConnectionError("Nothing heard from Redis for %s seconds" % self.max_silence)
+                    if now - pinged_at >= self.ping_interval:
+                        pubsub.ping()
+                        pinged_at = now
+            except redis.RedisError as e:
+                print(e)
+                self.heard_at = None
+                for _, _, on_disconnect in self.channels.values():
+                    if on_disconnect:
+                        on_disconnect()
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except redis.RedisError:
+                        pass
+                time.sleep(self.retry_interval)
@@ -0,0 +1,103 @@
+import time
+import hashlib
+import redis
+from flask import current_app, request
+from mef_mooc.scripts.cache import TTLCache
+from mef_mooc.scripts.models import db
+from mef_mooc.scripts.extensions import redis_client, invalidation
+from mef_mooc.scripts.constants import CATALOG_VERSION_TTL, CATALOG_TTL
+
+CATALOG_CHANNEL = 'mef_mooc:catalog'
+CATALOG_VERSION_KEY = 'mef_mooc:catalog_version'
+CATALOG_KEY = 'mef_mooc:catalog:{}:{}'
+
+CATALOG_QUERIES = {
+    'active': "SELECT id, name, url, average_hours FROM mooc WHERE is_active = True",
+    'all': "SELECT id, name, url, average_hours, is_active FROM mooc",
+}
+
+catalog_version = TTLCache(maxsize=1, ttl=CATALOG_VERSION_TTL)
+# Serialized bodies with their ETag, keyed by view and version so a bump needs no eviction
+catalogs = TTLCache(maxsize=2 * len(CATALOG_QUERIES), ttl=CATALOG_TTL)
+
+def get_catalog_version():
+    version = catalog_version.get('version')
+    if version is not None:
+        return version
+
+    try:
+        version = redis_client.get(CATALOG_VERSION_KEY)
+        if version is None:
+            # Starting from the clock keeps a lost key from reusing the version of an older catalog
+            redis_client.set(CATALOG_VERSION_KEY, int(time.time() * 1000), nx=True)
+            version = redis_client.get(CATALOG_VERSION_KEY)
+    except redis.RedisError as e:
+        print(e)
+        return None
+
+    version = int(version)
+    catalog_version.set('version', version)
+    return version
+
+# Call after the change is committed, the next read must not cache the old rows under the new version
+def bump_catalog_version():
+    catalog_version.clear()
+    try:
+        pipe = redis_client.pipeline()
+        pipe.incr(CATALOG_VERSION_KEY)
+        pipe.publish(CATALOG_CHANNEL, 'bump')
+        pipe.execute()
+    except redis.RedisError as e:
+        print(e)
+
+def etag_of(body):
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+def load_catalog(view):
+    moocs = db.fetch_rows(CATALOG_QUERIES[view])
+    return current_app.json.dumps({"moocs": moocs})
+
+def get_catalog(view):
+    # The version is read before the rows, so rows cached under it are never older than it
+    version = get_catalog_version()
+    if version is None:
+        body = load_catalog(view)
+        return body, etag_of(body)
+
+    catalog = catalogs.get((view, version))
+    if catalog is not None:
+        return catalog
+
+    key = CATALOG_KEY.format(view, version)
+    try:
+        body = redis_client.get(key)
+    except redis.RedisError as e:
+        print(e)
+        body = None
+
+    if body is None:
+        body = load_catalog(view)
+        try:
+            redis_client.set(key, body, ex=CATALOG_TTL)
+        except redis.RedisError as e:
+            print(e)
+
+    catalog = (body, etag_of(body))
+    catalogs.set((view, version), catalog)
+    return catalog
+
+def catalog_response(view):
+    body, etag = get_catalog(view)
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Clients keep the catalog but ask every time, a 304 costs them no body
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+def on_catalog_message(data):
+    catalog_version.clear()
+
+def on_catalog_subscribe():
+    catalog_version.clear()
+
+invalidation.subscribe(CATALOG_CHANNEL, on_catalog_message, on_subscribe=on_catalog_subscribe)
@@ -1,4 +1,24 @@
 
 FRONTEND_URL = "http://localhost:3000"
 HOURS_PER_CREDIT = 25
-TOTAL_COURSE_TIME_TOLLERANCE = 0.1 
\ No newline at end of file
+TOTAL_COURSE_TIME_TOLLERANCE = 0.1
+STREAM_BATCH_SIZE = 2000
+STREAM_FLUSH_ROWS = 500
+BULK_PAGE_SIZE = 1000
+BULK_COPY_THRESHOLD = 5000
+OWNERSHIP_CACHE_SIZE = 4096
+OWNERSHIP_CACHE_TTL = 300
+HASH_CHUNK_SIZE = 16
+JOB_PROGRESS_INTERVAL = 100
+JOB_TTL = 86400
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_HEARTBEAT_TIMEOUT = 60
+TOKEN_VERSION_CACHE_SIZE = 8192
+TOKEN_VERSION_CACHE_TTL = 60
+PUBLISH_ATTEMPTS = 2
+PUBLISHER_POOL_SIZE = 4
+SMTP_MAX_IDLE = 60
+RETRY_DELAYS = (5, 30, 120, 600)
+DIGEST_TTL = 86400
+CATALOG_VERSION_TTL = 60
+CATALOG_TTL = 86400
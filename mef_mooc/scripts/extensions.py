@@ -1,20 +1,113 @@
+import json
+import time
+import threading
+from flask.json.provider import DefaultJSONProvider
 from flask_jwt_extended import JWTManager
 from flask_bcrypt import Bcrypt
 import redis
-from mef_mooc.config import REDIS_HOST, REDIS_PORT, REDIS_DB
+from mef_mooc.config import REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_SOCKET_TIMEOUT, JWT_ACCESS_TOKEN_EXPIRES
+from mef_mooc.scripts.models import RowSet
+from mef_mooc.scripts.cache import InvalidationListener
 
 jwt = JWTManager()
 bcrypt = Bcrypt()
 
-jwt_redis_blocklist = redis.StrictRedis(
+class MoocJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        if isinstance(o, RowSet):
+            return o.as_dicts()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        # Pretty printing and nested row sets go through default, which builds every row's dict at once
+        if kwargs.get('indent') is not None or not isinstance(obj, dict) or \
+                not any(isinstance(value, RowSet) for value in obj.values()):
+            return super().dumps(obj, **kwargs)
+
+        # Row sets of a response are encoded one row at a time, only the current row is ever a dict
+        items = sorted(obj.items()) if kwargs.get('sort_keys', self.sort_keys) else obj.items()
+        item_separator, key_separator = kwargs.get('separators') or (', ', ': ')
+        parts = list()
+        for key, value in items:
+            if isinstance(value, RowSet):
+                encoded = "[%s]" % item_separator.join(super(MoocJSONProvider, self).dumps(row, **kwargs) for row in value)
+            else:
+                encoded = super().dumps(value, **kwargs)
+            parts.append(super().dumps(str(key), **kwargs) + key_separator + encoded)
+        return "{%s}" % item_separator.join(parts)
+
+redis_client = redis.StrictRedis(
         host=REDIS_HOST,
         port=REDIS_PORT,
         db=REDIS_DB,
-        decode_responses=True
+        decode_responses=True,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=30
     )
+jwt_redis_blocklist = redis_client
+
+invalidation = InvalidationListener(redis_client)
+
+REVOCATION_CHANNEL = 'mef_mooc:revocations'
+
+class RevocationCache:
+    def __init__(self, listener, subscribe_margin=1, prune_interval=60):
+        self.listener = listener
+        self.revoked = {}
+        self.lock = threading.Lock()
+        self.listening_since = None
+        self.subscribe_margin = subscribe_margin
+        self.prune_interval = prune_interval
+        self.pruned_at = time.time()
+
+    def add(self, jti, expires_at):
+        now = time.time()
+        with self.lock:
+            self.revoked[jti] = expires_at
+            if now - self.pruned_at > self.prune_interval:
+                self.revoked = {key: value for key, value in self.revoked.items() if value > now}
+                self.pruned_at = now
+
+    def is_revoked(self, jti):
+        with self.lock:
+            return jti in self.revoked
+
+    def covers(self, issued_at):
+        # Every revocation of a token issued after we started listening has reached us,
+        # older tokens may have been revoked before that and still need Redis
+        listening_since = self.listening_since
+        return listening_since is not None and self.listener.is_live() and issued_at > listening_since
+
+    def on_message(self, data):
+        message = json.loads(data)
+        self.add(message['jti'], message['exp'])
+
+    def on_subscribe(self):
+        self.listening_since = time.time() + self.subscribe_margin
+
+    def on_disconnect(self):
+        self.listening_since = None
+
+revocations = RevocationCache(invalidation)
+invalidation.subscribe(REVOCATION_CHANNEL, revocations.on_message,
+                       on_subscribe=revocations.on_subscribe, on_disconnect=revocations.on_disconnect)
+
+def revoke_token(jwt_payload):
+    jti = jwt_payload['jti']
+    jwt_redis_blocklist.set(jti, '', JWT_ACCESS_TOKEN_EXPIRES)
+    revocations.add(jti, jwt_payload['exp'])
+    redis_client.publish(REVOCATION_CHANNEL, json.dumps({'jti': jti, 'exp': jwt_payload['exp']}))
 
 @jwt.token_in_blocklist_loader
 def check_if_token_is_revoked(jwt_header, jwt_payload: dict):
     jti = jwt_payload["jti"]
+    if revocations.is_revoked(jti):
+        return True
+
+    if revocations.covers(jwt_payload.get("iat", 0)):
+        return False
+
     token_in_redis = jwt_redis_blocklist.get(jti)
-    return token_in_redis is not None
\ No newline at end of file
+    return token_in_redis is not None
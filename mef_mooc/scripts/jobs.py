@@ -0,0 +1,89 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import redis
+from flask_bcrypt import generate_password_hash
+from mef_mooc.config import PASSWORD_HASH_WORKERS
+from mef_mooc.scripts.constants import (HASH_CHUNK_SIZE, JOB_PROGRESS_INTERVAL, JOB_TTL, JOB_HEARTBEAT_INTERVAL,
+                                        JOB_HEARTBEAT_TIMEOUT)
+from mef_mooc.scripts.extensions import redis_client
+
+JOB_KEY = 'mef_mooc:job:{}'
+JOB_COUNTERS = ('total', 'done', 'created_at', 'finished_at', 'heartbeat_at')
+
+hash_pool = None
+hash_pool_lock = threading.Lock()
+
+def get_hash_pool():
+    global hash_pool
+    with hash_pool_lock:
+        if hash_pool is None:
+            # bcrypt releases the GIL while hashing, so threads use every core without forking the web process
+            hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+        return hash_pool
+
+def hash_password(password):
+    return generate_password_hash(password).decode('utf-8')
+
+def hash_passwords(passwords, on_progress=None):
+    hashed_passwords = list()
+    for hashed_password in get_hash_pool().map(hash_password, passwords, chunksize=HASH_CHUNK_SIZE):
+        hashed_passwords.append(hashed_password)
+        if on_progress and len(hashed_passwords) % JOB_PROGRESS_INTERVAL == 0:
+            on_progress(len(hashed_passwords))
+    return hashed_passwords
+
+def update_job(job_id, **fields):
+    key = JOB_KEY.format(job_id)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, mapping=fields)
+    pipe.expire(key, JOB_TTL)
+    pipe.execute()
+
+def create_job(kind, total):
+    job_id = uuid.uuid4().hex
+    now = int(time.time())
+    update_job(job_id, kind=kind, status='queued', total=total, done=0, created_at=now, heartbeat_at=now)
+    return job_id
+
+def get_job(job_id):
+    job = redis_client.hgetall(JOB_KEY.format(job_id))
+    if not job:
+        return None
+
+    for field in JOB_COUNTERS:
+        if field in job:
+            job[field] = int(job[field])
+    job['id'] = job_id
+
+    # Jobs run inside a web process, one that went away with it stops sending heartbeats
+    now = int(time.time())
+    if job['status'] in ('queued', 'running') and now - job.get('heartbeat_at', 0) > JOB_HEARTBEAT_TIMEOUT:
+        job.update(status='failed', error='The job was interrupted', finished_at=now)
+        update_job(job_id, status='failed', error=job['error'], finished_at=now)
+    return job
+
+def run_job(job_id, target, *args):
+    finished = threading.Event()
+
+    def heartbeat():
+        while not finished.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                update_job(job_id, heartbeat_at=int(time.time()))
+            except redis.RedisError as e:
+                print(e)
+
+    def run():
+        try:
+            update_job(job_id, status='running', heartbeat_at=int(time.time()))
+            target(job_id, *args)
+            update_job(job_id, status='finished', finished_at=int(time.time()))
+        except Exception as e:
+            print(e)
+            update_job(job_id, status='failed', error=str(e), finished_at=int(time.time()))
+        finally:
+            finished.set()
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    threading.Thread(target=run, daemon=True).start()
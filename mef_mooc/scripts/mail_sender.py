@@ -1,23 +1,112 @@
+import time
+import queue
 import smtplib
+import threading
+from contextlib import contextmanager
 from email.mime.text import MIMEText
-from mef_mooc.config import SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD
+from mef_mooc.config import (SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_SENDER,
+                             SMTP_STARTTLS, SMTP_TIMEOUT, SMTP_POOL_SIZE)
+from mef_mooc.scripts.constants import SMTP_MAX_IDLE
+from mef_mooc.scripts.transports import smtp_transport
 
-def send_mail(subject, message, receiver_mail):
-    smtp_server = SMTP_SERVER
-    smtp_port = SMTP_PORT
-    username = SMTP_USERNAME
-    password = SMTP_PASSWORD
-    server = smtplib.SMTP(smtp_server, smtp_port)
-    server.starttls()
-    server.login(username, password)
-
-    # Create the email message
-    msg = MIMEText(message)
-    msg['Subject'] = subject
-    msg['From'] = username
-    msg['To'] = receiver_mail
-
-    server.sendmail(username, msg["To"], msg.as_string())
-    server.quit()
+class SMTPPool:
+    def __init__(self, host, port, username, password, sender, starttls=True, size=SMTP_POOL_SIZE, max_idle=SMTP_MAX_IDLE):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.starttls = starttls
+        self.max_idle = max_idle
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def connect(self):
+        server = smtp_transport(self.host, self.port, timeout=SMTP_TIMEOUT)
+        if self.starttls:
+            server.starttls()
+        # A local stand-in like aiosmtpd runs without TLS or credentials
+        if self.username:
+            server.login(self.username, self.password)
+        return server
+
+    def close(self, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def checkout(self):
+        while True:
+            try:
+                server, released_at = self.idle.get_nowait()
+            except queue.Empty:
+                return self.connect()
+
+            if time.monotonic() - released_at < self.max_idle:
+                return server
+
+            # Servers drop idle sessions, an old one is checked before it is trusted
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close(server)
+
+    @contextmanager
+    def session(self, fresh=False):
+        with self.slots:
+            server = self.connect() if fresh else self.checkout()
+            try:
+                yield server
+            except smtplib.SMTPRecipientsRefused:
+                # smtplib resets the transaction before raising, the session itself is fine
+                self.idle.put((server, time.monotonic()))
+                raise
+            except Exception:
+                self.close(server)
+                raise
+            self.idle.put((server, time.monotonic()))
 
+    def build_message(self, subject, message, receiver_mail):
+        msg = MIMEText(message)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = receiver_mail
+        return msg
+
+    def send_many(self, mails):
+        mails = list(mails)
+        sent = 0
+        for attempt in range(2):
+            try:
+                with self.session(fresh=attempt > 0) as server:
+                    while sent < len(mails):
+                        subject, message, receiver_mail = mails[sent]
+                        msg = self.build_message(subject, message, receiver_mail)
+                        server.sendmail(self.sender, receiver_mail, msg.as_string())
+                        sent += 1
+                return sent
+            except smtplib.SMTPServerDisconnected:
+                # A session the server closed since its last check, a new connection gets the rest,
+                # another idle session could be just as stale
+                if attempt == 1:
+                    raise
+
+    def close_all(self):
+        while True:
+            try:
+                server, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self.close(server)
+
+smtp_pool = SMTPPool(SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_SENDER, starttls=SMTP_STARTTLS)
+
+def send_mail(subject, message, receiver_mail):
+    smtp_pool.send_many([(subject, message, receiver_mail)])
     return True
+
+def send_mails(mails):
+    return smtp_pool.send_many(mails)
@@ -0,0 +1,95 @@
+import functools
+from jinja2 import Environment, StrictUndefined, meta
+from mef_mooc.scripts.constants import FRONTEND_URL
+
+DEFAULT_LOCALE = 'en'
+
+# template id: (subject, body)
+MAIL_TEMPLATES = {
+    'en': {
+        'invitation': (
+            "MEF MOOC Invitation",
+            "You have been invited to MEF MOOC.\n{{ frontend_url }}\n\nYou can login with your email and password."
+            "{% if password is defined %}\nYour password is {{ password }}.{% endif %}"
+        ),
+        'coordinator_invitation': (
+            "MEF MOOC Coordinator Account",
+            "You have been invited to MEF MOOC as a coordinator.\n{{ frontend_url }}\n\n"
+            "You can login with your email and password.\nYour password is {{ password }}"
+        ),
+        'password_reset': (
+            "MEF MOOC Password Reset",
+            "Your MEF MOOC password reset succesfully.\nNew password: {{ password }}"
+        ),
+        'enrollment_rejected': (
+            "Course Enrollment",
+            "Your enrollment request for {{ course_name }} has been rejected by MOOC Coordinator.\n\n"
+            "Coordinator Message: {{ message }}"
+        ),
+        'bundle_approved': (
+            "Bundle Approved",
+            "Your bundle for {{ course_name }} has been approved. You can start your courses."
+        ),
+        'bundle_rejected': (
+            "Bundle Rejected",
+            "Your bundle for {{ course_name }} has been rejected.\nReason: {{ reason }}"
+        ),
+        'certificate_approved': (
+            "Course Completition",
+            "Your certificates has been approved. You completed the {{ course_name }} course succesfully."
+        ),
+        'certificate_rejected': (
+            "Course Completition",
+            "Your certificates for {{ course_name }} has been rejected. Please check your certificate URLs.\n"
+            "Reason: {{ reason }}"
+        ),
+        'digest': (
+            "MEF MOOC: {{ items|length }} new notifications",
+            "{% for item in items %}{{ item.subject }}\n{{ item.body }}{% if not loop.last %}\n\n---\n\n{% endif %}{% endfor %}"
+        ),
+    },
+}
+
+TEMPLATE_IDS = frozenset(MAIL_TEMPLATES[DEFAULT_LOCALE])
+# Course updates a coordinator tends to send many of at once, these can wait to be sent together
+DIGEST_TEMPLATES = frozenset({'enrollment_rejected', 'bundle_approved', 'bundle_rejected',
+                              'certificate_approved', 'certificate_rejected'})
+
+# Mails are plain text, so nothing is escaped, and a missing parameter fails instead of rendering empty
+environment = Environment(autoescape=False, undefined=StrictUndefined, keep_trailing_newline=True)
+environment.globals['frontend_url'] = FRONTEND_URL
+
+# Compiled once when the module is imported
+compiled_templates = {
+    (locale, template_id): (environment.from_string(subject), environment.from_string(body))
+    for locale, templates in MAIL_TEMPLATES.items()
+    for template_id, (subject, body) in templates.items()
+}
+# The parameters each subject uses, most use none and render the same for every mail
+subject_params = {
+    (locale, template_id): tuple(sorted(meta.find_undeclared_variables(environment.parse(subject)) - set(environment.globals)))
+    for locale, templates in MAIL_TEMPLATES.items()
+    for template_id, (subject, _) in templates.items()
+}
+
+def get_template(template_id, locale=None):
+    template = compiled_templates.get((locale or DEFAULT_LOCALE, template_id))
+    if template is None:
+        template = compiled_templates[(DEFAULT_LOCALE, template_id)]
+    return template
+
+@functools.lru_cache(maxsize=1024)
+def render_subject(template_id, locale, params):
+    return get_template(template_id, locale)[0].render(dict(params))
+
+def render_mail(template_id, params, locale=None):
+    subject_template, body_template = get_template(template_id, locale)
+    # Subjects repeat across a whole wave of mails, so they are cached on the parameters they use,
+    # never on the rest like passwords. Only plain values can be part of the cache key
+    locale = locale if (locale, template_id) in subject_params else DEFAULT_LOCALE
+    try:
+        subject = render_subject(template_id, locale,
+                                 tuple((name, params[name]) for name in subject_params[(locale, template_id)] if name in params))
+    except TypeError:
+        subject = subject_template.render(params)
+    return subject, body_template.render(params)
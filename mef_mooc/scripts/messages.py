@@ -0,0 +1,65 @@
+import ast
+import json
+import time
+import uuid
+from flask import g, request, has_request_context
+
+MESSAGE_VERSION = 1
+CONTENT_TYPE = 'application/json'
+
+MAIL = 'mail'
+DB_EXEC = 'db_exec'
+
+class MessageError(ValueError):
+    pass
+
+def current_trace_id():
+    # Messages published while handling one request share its trace id
+    if not has_request_context():
+        return uuid.uuid4().hex
+
+    if 'trace_id' not in g:
+        g.trace_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    return g.trace_id
+
+def encode_message(message_type, payload, trace_id=None):
+    envelope = {
+        'v': MESSAGE_VERSION,
+        'type': message_type,
+        'ts': time.time(),
+        'trace_id': trace_id or current_trace_id(),
+        'payload': payload,
+    }
+    return json.dumps(envelope, separators=(',', ':')).encode('utf-8')
+
+def decode_message(body, message_type=None):
+    try:
+        envelope = json.loads(body)
+    except ValueError:
+        envelope = decode_legacy_message(body, message_type)
+
+    if not isinstance(envelope, dict) or 'payload' not in envelope:
+        raise MessageError("Message is not an envelope")
+
+    if envelope.get('v') != MESSAGE_VERSION:
+        raise MessageError(f"Unsupported message version {envelope.get('v')}")
+
+    if message_type and envelope.get('type') != message_type:
+        raise MessageError(f"Expected a {message_type} message, got {envelope.get('type')}")
+
+    return envelope
+
+def decode_legacy_message(body, message_type):
+    # Bodies published as str(dict) before the envelope existed, read without eval
+    try:
+        payload = ast.literal_eval(body.decode('utf-8') if isinstance(body, bytes) else body)
+    except (ValueError, SyntaxError) as e:
+        raise MessageError(f"Could not decode message: {e}")
+
+    return {
+        'v': MESSAGE_VERSION,
+        'type': message_type,
+        'ts': None,
+        'trace_id': None,
+        'payload': payload,
+    }
@@ -0,0 +1,151 @@
+import sys
+from mef_mooc.scripts.models import db, create_tables
+
+MIGRATIONS = [
+    (1, "baseline schema", create_tables),
+
+    (2, "columns used by the code but missing from the baseline", """
+        ALTER TABLE department ADD COLUMN IF NOT EXISTS code VARCHAR(255);
+
+        ALTER TABLE bundle ADD COLUMN IF NOT EXISTS bundle_date TIMESTAMP;
+        ALTER TABLE bundle ADD COLUMN IF NOT EXISTS complete_date TIMESTAMP;
+        ALTER TABLE bundle ADD COLUMN IF NOT EXISTS certificate_date TIMESTAMP;
+        ALTER TABLE bundle ADD COLUMN IF NOT EXISTS certificate_coordinator INTEGER;
+
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_bundlecertificatecoordinator') THEN
+                ALTER TABLE bundle ADD CONSTRAINT FK_BundleCertificateCoordinator
+                    FOREIGN KEY (certificate_coordinator) REFERENCES coordinator(id);
+            END IF;
+        END $$;
+    """),
+
+    # coordinator.email, department.coordinator_id and bundle_detail(bundle_id, ...) are already
+    # covered by the indexes behind their UNIQUE constraints
+    (3, "hot path indexes", """
+        CREATE INDEX IF NOT EXISTS idx_student_email ON student (email);
+        CREATE INDEX IF NOT EXISTS idx_student_department ON student (department_id);
+        CREATE INDEX IF NOT EXISTS idx_mefcourse_department_active ON MEFcourse (department_id, is_active);
+        CREATE INDEX IF NOT EXISTS idx_mefcourse_semester ON MEFcourse (semester);
+        CREATE INDEX IF NOT EXISTS idx_enrollment_course_waiting ON enrollment (course_id, is_waiting);
+        CREATE INDEX IF NOT EXISTS idx_bundle_enrollment_status ON bundle (enrollment_id, status);
+        CREATE INDEX IF NOT EXISTS idx_bundle_accepted ON bundle (enrollment_id) WHERE status = 'Accepted Certificates';
+    """),
+
+    (4, "token versions", """
+        ALTER TABLE student ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE coordinator ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0;
+    """),
+
+    (5, "notification outbox", """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            queue VARCHAR(255) NOT NULL,
+            body TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    """),
+]
+
+# (endpoint, query, params, indexes the plan may use)
+PLAN_CHECKS = [
+    ("student login", "SELECT * FROM student WHERE email = %s LIMIT 1",
+        ('student@mef.edu.tr',), ('idx_student_email',)),
+    ("coordinator login", "SELECT * FROM coordinator WHERE email = %s and is_active = True LIMIT 1",
+        ('coordinator@mef.edu.tr',), ('coordinator_email_key',)),
+    ("coordinator department", "SELECT * FROM department WHERE coordinator_id = %s LIMIT 1",
+        (1,), ('department_coordinator_id_key',)),
+    ("active courses", "SELECT * FROM MEFcourse WHERE department_id = %s and is_active = True",
+        (1,), ('idx_mefcourse_department_active',)),
+    ("waiting students", "SELECT * FROM enrollment WHERE course_id = %s and is_waiting = True",
+        (1,), ('idx_enrollment_course_waiting',)),
+    ("student bundles", "SELECT * FROM bundle WHERE enrollment_id = %s AND status = 'Waiting Bundle'",
+        (1,), ('idx_bundle_enrollment_status',)),
+    ("bundle details", "SELECT * FROM bundle_detail WHERE bundle_id = %s",
+        (1,), ('bundle_detail_bundle_id_mooc_id_key',)),
+    ("semester report courses", "SELECT id FROM MEFcourse WHERE semester = %s",
+        ('2022-2023-Fall',), ('idx_mefcourse_semester',)),
+    ("semester report bundles", "SELECT * FROM bundle WHERE enrollment_id = %s and status = 'Accepted Certificates'",
+        (1,), ('idx_bundle_accepted', 'idx_bundle_enrollment_status')),
+]
+
+def applied_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+def upgrade():
+    with db.connection() as connection:
+        connection.autocommit = False
+        with connection.cursor() as cursor:
+            # Keeps two deploys from migrating at the same time
+            cursor.execute("SELECT pg_advisory_lock(hashtext('schema_migrations'))")
+            try:
+                applied = applied_versions(cursor)
+                connection.commit()
+
+                for version, name, sql in MIGRATIONS:
+                    if version in applied:
+                        continue
+                    try:
+                        cursor.execute(sql)
+                        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                        connection.commit()
+                    except Exception:
+                        connection.rollback()
+                        raise
+                    print("Applied migration %s: %s" % (version, name))
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'))")
+                connection.commit()
+
+def status():
+    with db.connection() as connection:
+        with connection.cursor() as cursor:
+            applied = applied_versions(cursor)
+    for version, name, _ in MIGRATIONS:
+        print("[%s] %s: %s" % ("x" if version in applied else " ", version, name))
+
+def used_indexes(plan):
+    indexes = set()
+    if 'Index Name' in plan:
+        indexes.add(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        indexes |= used_indexes(child)
+    return indexes
+
+def check():
+    failed = 0
+    with db.connection() as connection:
+        connection.autocommit = False
+        with connection.cursor() as cursor:
+            # Small development tables are always cheaper to scan, so ask whether an index can be used at all
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            for endpoint, query, params, expected in PLAN_CHECKS:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                indexes = used_indexes(cursor.fetchone()[0][0]['Plan'])
+                if indexes & set(expected):
+                    print("ok      %s: %s" % (endpoint, ", ".join(sorted(indexes))))
+                else:
+                    failed += 1
+                    print("MISSING %s: expected one of %s, plan used %s" % (endpoint, ", ".join(expected), ", ".join(sorted(indexes)) or "no index"))
+        connection.rollback()
+    return failed
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    if command == 'upgrade':
+        upgrade()
+    elif command == 'status':
+        status()
+    elif command == 'check':
+        sys.exit(1 if check() else 0)
+    else:
+        exit('Usage: python -m mef_mooc.scripts.migrations [upgrade|status|check]')
@@ -1,41 +1,388 @@
+import io
+import csv
 import uuid
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
 import psycopg2
 import psycopg2.extras
-from mef_mooc.config import DATABASE_HOST, DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD, DATABASE_PORT
+import psycopg2.pool
+from psycopg2 import sql
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from flask import g, has_app_context
+from mef_mooc.scripts.constants import STREAM_BATCH_SIZE, BULK_PAGE_SIZE, BULK_COPY_THRESHOLD
+from mef_mooc.scripts.profiling import record_query
+from mef_mooc.config import (DATABASE_HOST, DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD, DATABASE_PORT,
+                             DATABASE_POOL_MIN, DATABASE_POOL_MAX, DATABASE_POOL_TIMEOUT)
+
+class PoolTimeout(Exception):
+    pass
+
+class RowSet:
+    # Plain tuples plus one shared column tuple, turned into JSON objects only while serializing
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        columns = self.columns
+        return (dict(zip(columns, row)) for row in self.rows)
+
+    def as_dicts(self):
+        return list(self)
 
 class Database:
-    def __init__(self):
-        self.connection = psycopg2.connect(
+    def __init__(self, minconn=DATABASE_POOL_MIN, maxconn=DATABASE_POOL_MAX, timeout=DATABASE_POOL_TIMEOUT):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn,
+            maxconn,
             host=DATABASE_HOST,
             database=DATABASE_NAME,
             user=DATABASE_USER,
             password=DATABASE_PASSWORD,
             port=DATABASE_PORT
         )
-        self.cursor = self.connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        self.connection.autocommit = True
+        self.timeout = timeout
+        # ThreadedConnectionPool raises as soon as it is exhausted, the semaphore makes callers wait instead
+        self.slots = threading.BoundedSemaphore(maxconn)
+        # Connection pinned by an open transaction outside of an app context (e.g. receiver.py)
+        self.local = threading.local()
+
+    def init_app(self, app):
+        app.teardown_appcontext(self.release)
+
+    def checkout(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout("No database connection available after %s seconds" % self.timeout)
+
+        connection = None
+        try:
+            connection = self.pool.getconn()
+            if not self.is_healthy(connection):
+                self.pool.putconn(connection, close=True)
+                connection = None
+                connection = self.pool.getconn()
+                connection.autocommit = True
+        except Exception:
+            if connection is not None:
+                self.pool.putconn(connection, close=True)
+            self.slots.release()
+            raise
+
+        return connection
+
+    def checkin(self, connection):
+        close = bool(connection.closed)
+        try:
+            if not close:
+                if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                # Callers like migrations.py switch autocommit off, the next borrower expects it on
+                connection.autocommit = True
+        except psycopg2.Error:
+            close = True
+        self.pool.putconn(connection, close=close)
+        self.slots.release()
+
+    def is_healthy(self, connection):
+        if connection.closed:
+            return False
+        try:
+            # Set before the ping, autocommit cannot be changed once the SELECT has opened a transaction
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        # Inside a request the connection is borrowed once and returned on app context teardown
+        if has_app_context():
+            if 'db_connection' not in g:
+                g.db_connection = self.checkout()
+            yield g.db_connection
+            return
+
+        pinned = getattr(self.local, 'connection', None)
+        if pinned is not None:
+            yield pinned
+            return
+
+        connection = self.checkout()
+        try:
+            yield connection
+        finally:
+            self.checkin(connection)
+
+    def release(self, exception=None):
+        connection = g.pop('db_connection', None)
+        if connection is not None:
+            self.checkin(connection)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as connection:
+            # Nested blocks join the outer transaction
+            if not connection.autocommit:
+                yield connection
+                return
+
+            pin = not has_app_context()
+            if pin:
+                self.local.connection = connection
+
+            connection.autocommit = False
+            try:
+                yield connection
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                connection.autocommit = True
+                if pin:
+                    self.local.connection = None
 
     def execute(self, query, params=()):
-        self.cursor.execute(query, params)
+        started_at = time.perf_counter()
+        with self.connection() as connection:
+            with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(query, params)
+                record_query(query, started_at, cursor.rowcount)
         
+    def execute_many(self, query, params_list):
+        started_at = time.perf_counter()
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                psycopg2.extras.execute_batch(cursor, query, params_list, page_size=BULK_PAGE_SIZE)
+                record_query(query, started_at, len(params_list))
+
+    @contextmanager
+    def savepoint(self):
+        # Lets part of an open transaction fail without aborting the rest of it
+        with self.connection() as connection:
+            if connection.autocommit:
+                raise RuntimeError("savepoint() needs an open transaction")
+
+            name = 'savepoint_' + uuid.uuid4().hex
+            with connection.cursor() as cursor:
+                cursor.execute("SAVEPOINT " + name)
+            try:
+                yield connection
+            except Exception:
+                with connection.cursor() as cursor:
+                    cursor.execute("ROLLBACK TO SAVEPOINT " + name)
+                raise
+            with connection.cursor() as cursor:
+                cursor.execute("RELEASE SAVEPOINT " + name)
+
     def fetch(self, query, params=()):
-        self.cursor.execute(query, params)
-        result = self.cursor.fetchall()
+        started_at = time.perf_counter()
+        with self.connection() as connection:
+            with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(query, params)
+                result = cursor.fetchall()
+        record_query(query, started_at, len(result))
         return [dict(row) for row in result]
 
     def fetch_one(self, query, params=()):
-        self.cursor.execute(query, params)
-        result = dict(self.cursor.fetchone()) if self.cursor.rowcount > 0 else None
+        started_at = time.perf_counter()
+        with self.connection() as connection:
+            with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(query, params)
+                result = dict(cursor.fetchone()) if cursor.rowcount > 0 else None
+                record_query(query, started_at, cursor.rowcount)
+        return result
+
+    def insert_many(self, table, columns, rows, on_conflict=None):
+        if not rows:
+            return
+
+        if len(rows) >= BULK_COPY_THRESHOLD:
+            self.copy_rows(table, columns, rows, on_conflict)
+            return
+
+        query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+            sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns)))
+        if on_conflict:
+            query += sql.SQL(" ON CONFLICT " + on_conflict)
+
+        started_at = time.perf_counter()
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                psycopg2.extras.execute_values(cursor, query, rows, page_size=BULK_PAGE_SIZE)
+                record_query(query.as_string(connection), started_at, len(rows))
+
+    def copy_rows(self, table, columns, rows, on_conflict=None):
+        # Everything is quoted so '' stays an empty string, only the marker becomes NULL, as with execute_values
+        null = "null_" + uuid.uuid4().hex
+        buffer = io.StringIO()
+        csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(
+            [null if value is None else value for value in row] for row in rows)
+        buffer.seek(0)
+
+        column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+        copy_options = sql.SQL("(FORMAT csv, NULL {}, FORCE_NULL ({}))").format(sql.Literal(null), column_list)
+        started_at = time.perf_counter()
+        with self.transaction() as connection:
+            with connection.cursor() as cursor:
+                if not on_conflict:
+                    copy = sql.SQL("COPY {} ({}) FROM STDIN WITH {}").format(sql.Identifier(table), column_list, copy_options)
+                    cursor.copy_expert(copy.as_string(connection), buffer)
+                else:
+                    # COPY cannot resolve conflicts itself, so the rows go through a staging table.
+                    # Unique per call, an outer transaction can copy into the same table more than once
+                    staging = sql.Identifier("bulk_%s_%s" % (table, uuid.uuid4().hex))
+                    cursor.execute(sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+                        staging, column_list, sql.Identifier(table)))
+                    copy = sql.SQL("COPY {} ({}) FROM STDIN WITH {}").format(staging, column_list, copy_options)
+                    cursor.copy_expert(copy.as_string(connection), buffer)
+                    cursor.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT " + on_conflict).format(
+                        sql.Identifier(table), column_list, column_list, staging))
+                record_query("COPY " + table, started_at, len(rows))
+
+    def fetch_rows(self, query, params=()):
+        started_at = time.perf_counter()
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                columns = tuple(column.name for column in cursor.description)
+        record_query(query, started_at, len(rows))
+        return RowSet(columns, rows)
+
+    def stream(self, query, params=(), batch_size=STREAM_BATCH_SIZE):
+        # Named cursors live on the server and need a transaction. Inside a request it runs on the request's
+        # own connection, a second connection per report would let a burst of reports drain the pool
+        with self.connection() as connection:
+            # Inside an open transaction the cursor simply joins it
+            owns_transaction = connection.autocommit
+            if owns_transaction:
+                connection.autocommit = False
+            try:
+                with connection.cursor(name='stream_' + uuid.uuid4().hex) as cursor:
+                    cursor.itersize = batch_size
+                    started_at = time.perf_counter()
+                    cursor.execute(query, params)
+                    # The row count of a stream is unknown until it is consumed
+                    record_query(query, started_at, -1)
+                    columns = None
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        if columns is None:
+                            columns = tuple(column.name for column in cursor.description)
+                        for row in rows:
+                            yield dict(zip(columns, row))
+                if owns_transaction:
+                    connection.commit()
+            finally:
+                # Also reached through GeneratorExit when the client goes away mid stream
+                if owns_transaction and not connection.closed:
+                    if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                        connection.rollback()
+                    connection.autocommit = True
+
+    def close(self):
+        self.pool.closeall()
+
+class AsyncDatabase:
+    def __init__(self, min_size=DATABASE_POOL_MIN, max_size=DATABASE_POOL_MAX, timeout=DATABASE_POOL_TIMEOUT):
+        self.conninfo = make_conninfo(
+            host=DATABASE_HOST,
+            dbname=DATABASE_NAME,
+            user=DATABASE_USER,
+            password=DATABASE_PASSWORD,
+            port=DATABASE_PORT
+        )
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.loop = None
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Flask runs every async view on its own short-lived event loop, so the pool lives on
+        # a dedicated loop thread and views hand their queries over to it
+        with self.lock:
+            if self.loop is not None:
+                return
+
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='async-database', daemon=True).start()
+            self.pool = asyncio.run_coroutine_threadsafe(self.open_pool(), loop).result()
+            self.loop = loop
+
+    async def open_pool(self):
+        pool = AsyncConnectionPool(
+            self.conninfo,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            timeout=self.timeout,
+            kwargs={'autocommit': True, 'row_factory': dict_row},
+            open=False
+        )
+        await pool.open(wait=True)
+        return pool
+
+    def submit(self, coroutine):
+        self.start()
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self.loop))
+
+    async def execute(self, query, params=()):
+        started_at = time.perf_counter()
+        await self.submit(self.run_execute(query, params))
+        record_query(query, started_at, -1)
+
+    async def fetch(self, query, params=()):
+        started_at = time.perf_counter()
+        result = await self.submit(self.run_fetch(query, params))
+        record_query(query, started_at, len(result))
+        return result
+
+    async def fetch_one(self, query, params=()):
+        started_at = time.perf_counter()
+        result = await self.submit(self.run_fetch_one(query, params))
+        record_query(query, started_at, 1 if result else 0)
         return result
 
-    def __del__(self):
-        self.cursor.close()
-        self.connection.close()
+    async def run_execute(self, query, params):
+        async with self.pool.connection() as connection:
+            await connection.execute(query, params)
+
+    async def run_fetch(self, query, params):
+        async with self.pool.connection() as connection:
+            cursor = await connection.execute(query, params)
+            return await cursor.fetchall()
+
+    async def run_fetch_one(self, query, params):
+        async with self.pool.connection() as connection:
+            cursor = await connection.execute(query, params)
+            return await cursor.fetchone()
+
+    def close(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.pool.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop = None
 
 
 create_tables = """
 
-CREATE TABLE coordinator (
+CREATE TABLE IF NOT EXISTS coordinator (
     id SERIAL PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
     surname VARCHAR(255) NOT NULL,
@@ -45,7 +392,7 @@ CREATE TABLE coordinator (
     created_at TIMESTAMP NOT NULL DEFAULT NOW()
 );
 
-CREATE TABLE department (
+CREATE TABLE IF NOT EXISTS department (
     id SERIAL PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
     coordinator_id INTEGER UNIQUE NOT NULL,
@@ -53,7 +400,7 @@ CREATE TABLE department (
     CONSTRAINT FK_DepartmentCoordinator FOREIGN KEY (coordinator_id) REFERENCES coordinator(id)
 );
 
-CREATE TABLE student (
+CREATE TABLE IF NOT EXISTS student (
     id SERIAL PRIMARY KEY,
     student_no VARCHAR(255) NOT NULL UNIQUE,
     name VARCHAR(255) NOT NULL,
@@ -65,7 +412,7 @@ CREATE TABLE student (
     CONSTRAINT FK_StudentDepartment FOREIGN KEY (department_id) REFERENCES department(id)
 );
 
-CREATE TABLE MEFcourse (
+CREATE TABLE IF NOT EXISTS MEFcourse (
     id SERIAL PRIMARY KEY,
     course_code VARCHAR(255) NOT NULL,
     name VARCHAR(255) NOT NULL,
@@ -81,7 +428,7 @@ CREATE TABLE MEFcourse (
     CONSTRAINT FK_MEFcourseCoordinator FOREIGN KEY (coordinator_id) REFERENCES coordinator(id)
 );
 
-CREATE TABLE enrollment (
+CREATE TABLE IF NOT EXISTS enrollment (
     id SERIAL PRIMARY KEY,
     student_id INTEGER NOT NULL,
     course_id INTEGER NOT NULL,
@@ -94,7 +441,7 @@ CREATE TABLE enrollment (
     CONSTRAINT FK_EnrollmentCourse FOREIGN KEY (course_id) REFERENCES MEFcourse(id)
 );
 
-CREATE TABLE bundle (
+CREATE TABLE IF NOT EXISTS bundle (
     id SERIAL PRIMARY KEY,
     created_at TIMESTAMP NOT NULL DEFAULT NOW(),
     coordinator_id INTEGER,
@@ -106,7 +453,7 @@ CREATE TABLE bundle (
     CONSTRAINT FK_BundleEnrollment FOREIGN KEY (enrollment_id) REFERENCES enrollment(id)
 );
 
-CREATE TABLE mooc (
+CREATE TABLE IF NOT EXISTS mooc (
     id SERIAL PRIMARY KEY,
     platform VARCHAR(255),
     name VARCHAR(255) NOT NULL,
@@ -129,7 +476,7 @@ CREATE TABLE mooc (
     created_at TIMESTAMP NOT NULL DEFAULT NOW()
 );
 
-CREATE TABLE bundle_detail (
+CREATE TABLE IF NOT EXISTS bundle_detail (
     id SERIAL PRIMARY KEY,
     bundle_id INTEGER NOT NULL,
     mooc_id INTEGER NOT NULL,
@@ -143,3 +490,4 @@ CREATE TABLE bundle_detail (
 """
 
 db = Database()
+async_db = AsyncDatabase()
@@ -0,0 +1,126 @@
+import json
+import hashlib
+import redis
+from mef_mooc.config import MAIL_DEDUP_WINDOW, MAIL_DIGEST_WINDOW
+from mef_mooc.scripts.constants import DIGEST_TTL
+from mef_mooc.scripts.extensions import redis_client
+from mef_mooc.scripts.mail_templates import DIGEST_TEMPLATES, render_mail
+from mef_mooc.scripts.messages import MAIL, encode_message
+from mef_mooc.scripts.retries import dead_letter_queue
+
+DEDUP_KEY = 'mef_mooc:mail_dedup:{}'
+DIGEST_KEY = 'mef_mooc:mail_digest:{}'
+DIGEST_SCHEDULED_KEY = 'mef_mooc:mail_digest_scheduled:{}'
+
+def dedup_key(mail):
+    fingerprint = json.dumps([mail['email'], mail['template'], mail.get('params', {}), mail.get('locale')], sort_keys=True)
+    return DEDUP_KEY.format(hashlib.sha256(fingerprint.encode('utf-8')).hexdigest())
+
+def is_repeated(mail):
+    if not MAIL_DEDUP_WINDOW:
+        return False
+
+    try:
+        return bool(redis_client.exists(dedup_key(mail)))
+    except redis.RedisError as e:
+        # Sending a duplicate is better than losing a mail
+        print(e)
+        return False
+
+# Only once the mail is out, a redelivery after a crash before this point must still send it
+def remember_mail(mail):
+    if not MAIL_DEDUP_WINDOW:
+        return
+
+    try:
+        redis_client.set(dedup_key(mail), 1, nx=True, ex=MAIL_DEDUP_WINDOW)
+    except redis.RedisError as e:
+        print(e)
+
+def digest_queue(queue):
+    return '%s.digest' % queue
+
+def declare_digest_queue(channel, queue):
+    # A flush message waits here for the window and then goes back to the lane it came from
+    channel.queue_declare(queue=digest_queue(queue), arguments={
+        'x-message-ttl': MAIL_DIGEST_WINDOW * 1000,
+        'x-dead-letter-exchange': '',
+        'x-dead-letter-routing-key': queue,
+    })
+
+def is_digested(mail):
+    return bool(MAIL_DIGEST_WINDOW) and mail['template'] in DIGEST_TEMPLATES
+
+def schedule_digest(publisher, queue, email):
+    # One pending flush per recipient, however many mails join the digest meanwhile
+    scheduled_key = DIGEST_SCHEDULED_KEY.format(email)
+    if not redis_client.set(scheduled_key, 1, nx=True, ex=DIGEST_TTL):
+        return
+
+    try:
+        publisher.publish(digest_queue(queue), encode_message(MAIL, {'email': email, 'digest': True}))
+    except Exception:
+        redis_client.delete(scheduled_key)
+        raise
+
+def add_to_digest(publisher, queue, mail):
+    item = json.dumps({'template': mail['template'], 'params': mail.get('params', {}), 'locale': mail.get('locale')})
+    key = DIGEST_KEY.format(mail['email'])
+
+    pipe = redis_client.pipeline()
+    pipe.rpush(key, item)
+    pipe.expire(key, DIGEST_TTL)
+    pipe.execute()
+    schedule_digest(publisher, queue, mail['email'])
+
+def render_digest(raw_items):
+    rendered = list()
+    failed = list()
+    locale = None
+    # A mail redelivered after a crash can be in the list twice
+    for raw_item in dict.fromkeys(raw_items):
+        # One broken item must not hold back the rest, or keep failing every later flush
+        try:
+            item = json.loads(raw_item)
+            rendered.append(render_mail(item['template'], item['params'], item.get('locale')))
+            locale = locale or item.get('locale')
+        except Exception as e:
+            print(e)
+            failed.append(raw_item)
+
+    if len(rendered) <= 1:
+        return (rendered[0] if rendered else None), failed
+    return render_mail('digest', {'items': [{'subject': subject, 'body': body} for subject, body in rendered]},
+                       locale), failed
+
+def dead_letter_items(publisher, queue, email, raw_items):
+    for raw_item in raw_items:
+        try:
+            mail = dict(json.loads(raw_item), email=email)
+        except ValueError:
+            mail = {'email': email, 'digest_item': raw_item}
+        publisher.publish(dead_letter_queue(queue), encode_message(MAIL, mail))
+
+def send_digest(publisher, queue, email, send_mail):
+    key = DIGEST_KEY.format(email)
+    # Cleared first, so a mail arriving from here on schedules the next flush itself
+    redis_client.delete(DIGEST_SCHEDULED_KEY.format(email))
+
+    raw_items = redis_client.lrange(key, 0, -1)
+    if not raw_items:
+        return
+
+    mail, failed = render_digest(raw_items)
+    if mail is not None:
+        subject, body = mail
+        send_mail(subject, body, email)
+    # After the send, so a retried flush does not dead letter them twice
+    dead_letter_items(publisher, queue, email, failed)
+
+    # Only what was handled is removed, mails added meanwhile wait for the next flush
+    pipe = redis_client.pipeline()
+    pipe.ltrim(key, len(raw_items), -1)
+    pipe.llen(key)
+    _, remaining = pipe.execute()
+    if remaining:
+        schedule_digest(publisher, queue, email)
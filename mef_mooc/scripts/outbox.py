@@ -0,0 +1,16 @@
+from mef_mooc.scripts.models import db
+
+OUTBOX_CHANNEL = 'mef_mooc_outbox'
+
+def enqueue(queue, body):
+    enqueue_many(queue, [body])
+
+def enqueue_many(queue, bodies):
+    if not bodies:
+        return
+
+    # Joins the caller's transaction, so the messages are only relayed if its changes commit
+    with db.transaction():
+        db.insert_many("outbox", ("queue", "body"), [(queue, body.decode('utf-8')) for body in bodies])
+        # Delivered on commit, wakes the relay up without waiting for its next poll
+        db.execute("SELECT pg_notify(%s, '')", (OUTBOX_CHANNEL,))
@@ -0,0 +1,55 @@
+import json
+import redis
+from mef_mooc.scripts.cache import TTLCache
+from mef_mooc.scripts.models import db
+from mef_mooc.scripts.extensions import redis_client, invalidation
+from mef_mooc.scripts.constants import OWNERSHIP_CACHE_SIZE, OWNERSHIP_CACHE_TTL
+
+OWNERSHIP_CHANNEL = 'mef_mooc:ownership'
+
+coordinator_departments = TTLCache(maxsize=OWNERSHIP_CACHE_SIZE, ttl=OWNERSHIP_CACHE_TTL)
+# A course never moves to another department, so these entries only expire
+course_departments = TTLCache(maxsize=OWNERSHIP_CACHE_SIZE, ttl=OWNERSHIP_CACHE_TTL)
+
+def cached_coordinator_department(coordinator_id):
+    department = coordinator_departments.get(coordinator_id)
+    return dict(department) if department is not None else None
+
+def cache_coordinator_department(coordinator_id, department):
+    if department is not None:
+        coordinator_departments.set(coordinator_id, dict(department))
+
+def get_coordinator_department(coordinator_id):
+    department = cached_coordinator_department(coordinator_id)
+    if department is None:
+        department = db.fetch_one("SELECT * FROM department WHERE coordinator_id = %s LIMIT 1", (coordinator_id,))
+        cache_coordinator_department(coordinator_id, department)
+    return department
+
+def get_course_department_id(course_id):
+    department_id = course_departments.get(course_id)
+    if department_id is None:
+        course = db.fetch_one("SELECT department_id FROM MEFcourse WHERE id = %s LIMIT 1", (course_id,))
+        if not course:
+            return None
+        department_id = course['department_id']
+        course_departments.set(course_id, department_id)
+    return department_id
+
+def invalidate_coordinators(*coordinator_ids):
+    for coordinator_id in coordinator_ids:
+        coordinator_departments.delete(coordinator_id)
+
+    try:
+        redis_client.publish(OWNERSHIP_CHANNEL, json.dumps({'coordinators': coordinator_ids}))
+    except redis.RedisError as e:
+        print(e)
+
+def on_ownership_message(data):
+    for coordinator_id in json.loads(data).get('coordinators', []):
+        coordinator_departments.delete(coordinator_id)
+
+def on_ownership_subscribe():
+    coordinator_departments.clear()
+
+invalidation.subscribe(OWNERSHIP_CHANNEL, on_ownership_message, on_subscribe=on_ownership_subscribe)
@@ -0,0 +1,44 @@
+import re
+import time
+import functools
+from collections import Counter
+from flask import g, has_request_context, request
+from mef_mooc.config import QUERY_PROFILING, QUERY_REPEAT_THRESHOLD
+
+@functools.lru_cache(maxsize=1024)
+def normalize_query(query):
+    query = re.sub(r"'(?:[^']|'')*'", "?", query)
+    query = re.sub(r"\b\d+(\.\d+)?\b", "?", query)
+    return re.sub(r"\s+", " ", query).strip()
+
+def record_query(query, started_at, rowcount):
+    if not QUERY_PROFILING or not has_request_context():
+        return
+
+    if 'query_log' not in g:
+        g.query_log = []
+    g.query_log.append((normalize_query(query), time.perf_counter() - started_at, rowcount))
+
+def repeated_queries(query_log, threshold=QUERY_REPEAT_THRESHOLD):
+    counts = Counter(query for query, _, _ in query_log)
+    return {query: count for query, count in counts.items() if count > threshold}
+
+def add_profiling_headers(response):
+    query_log = g.get('query_log', [])
+    total_time = sum(duration for _, duration, _ in query_log) * 1000
+    total_rows = sum(rowcount for _, _, rowcount in query_log if rowcount > 0)
+
+    response.headers['Server-Timing'] = 'db;dur=%.2f;desc="%d queries, %d rows"' % (total_time, len(query_log), total_rows)
+    response.headers['X-Query-Count'] = str(len(query_log))
+
+    repeated = repeated_queries(query_log)
+    if repeated:
+        response.headers['X-Repeated-Queries'] = str(len(repeated))
+        for query, count in repeated.items():
+            print("[N+1] %s %s ran %d times: %s" % (request.method, request.path, count, query))
+
+    return response
+
+def init_app(app):
+    if QUERY_PROFILING:
+        app.after_request(add_profiling_headers)
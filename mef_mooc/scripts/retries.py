@@ -0,0 +1,105 @@
+import sys
+import time
+import pika
+from mef_mooc.scripts.constants import RETRY_DELAYS
+from mef_mooc.scripts.messages import MessageError, decode_message
+from mef_mooc.scripts.transports import connect_broker
+
+ATTEMPT_HEADER = 'x-attempt'
+ERROR_HEADER = 'x-error'
+FAILED_AT_HEADER = 'x-failed-at'
+
+def retry_queue(queue, attempt):
+    return '%s.retry.%d' % (queue, attempt)
+
+def dead_letter_queue(queue):
+    return '%s.dead' % queue
+
+def declare_queues(channel, queue):
+    channel.queue_declare(queue=queue)
+    # One queue per delay, so a long delay never holds back a message waiting for a short one
+    for attempt, delay in enumerate(RETRY_DELAYS, start=1):
+        channel.queue_declare(queue=retry_queue(queue, attempt), arguments={
+            'x-message-ttl': delay * 1000,
+            'x-dead-letter-exchange': '',
+            'x-dead-letter-routing-key': queue,
+        })
+    channel.queue_declare(queue=dead_letter_queue(queue))
+
+def attempt_of(properties):
+    return int((properties.headers or {}).get(ATTEMPT_HEADER, 0))
+
+def failed_properties(properties, attempt, error):
+    headers = dict(properties.headers or {})
+    headers[ATTEMPT_HEADER] = attempt
+    headers[ERROR_HEADER] = ('%s: %s' % (type(error).__name__, error))[:1000]
+    headers[FAILED_AT_HEADER] = int(time.time())
+    return pika.BasicProperties(content_type=properties.content_type, headers=headers)
+
+def retry_or_dead_letter(channel, queue, body, properties, error, poison=False):
+    attempt = attempt_of(properties) + 1
+    if poison or attempt > len(RETRY_DELAYS):
+        target = dead_letter_queue(queue)
+    else:
+        target = retry_queue(queue, attempt)
+
+    channel.basic_publish(exchange='', routing_key=target, body=body, properties=failed_properties(properties, attempt, error))
+    return target
+
+def describe(body, properties):
+    headers = properties.headers or {}
+    try:
+        envelope = decode_message(body)
+        summary = "%s trace=%s" % (envelope['type'], envelope['trace_id'])
+    except MessageError:
+        summary = "undecodable %r" % body[:80]
+    return "attempt=%s failed_at=%s %s\n        %s" % (headers.get(ATTEMPT_HEADER), headers.get(FAILED_AT_HEADER),
+                                                     summary, headers.get(ERROR_HEADER))
+
+def list_dead_letters(channel, queue, limit):
+    seen = 0
+    while seen < limit:
+        method, properties, body = channel.basic_get(queue=dead_letter_queue(queue))
+        if method is None:
+            break
+        seen += 1
+        print("%4d %s" % (seen, describe(body, properties)))
+    # Nothing was acked, closing the channel puts every message back
+    print("%d message(s) in %s" % (seen, dead_letter_queue(queue)))
+
+def replay_dead_letters(channel, queue, limit):
+    replayed = 0
+    while replayed < limit:
+        method, properties, body = channel.basic_get(queue=dead_letter_queue(queue))
+        if method is None:
+            break
+        # A replayed message starts over with the full set of retries
+        headers = {key: value for key, value in (properties.headers or {}).items()
+                   if key not in (ATTEMPT_HEADER, ERROR_HEADER, FAILED_AT_HEADER)}
+        channel.basic_publish(exchange='', routing_key=queue, body=body,
+                              properties=pika.BasicProperties(content_type=properties.content_type, headers=headers))
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        replayed += 1
+    print("Replayed %d message(s) to %s" % (replayed, queue))
+
+def purge_dead_letters(channel, queue):
+    result = channel.queue_purge(queue=dead_letter_queue(queue))
+    print("Purged %d message(s) from %s" % (result.method.message_count, dead_letter_queue(queue)))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('list', 'replay', 'purge'):
+        sys.exit("usage: python -m mef_mooc.scripts.retries list|replay|purge <queue> [limit]")
+
+    command, queue = sys.argv[1], sys.argv[2]
+    limit = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+    connection = connect_broker()
+    channel = connection.channel()
+    declare_queues(channel, queue)
+    if command == 'list':
+        list_dead_letters(channel, queue, limit)
+    elif command == 'replay':
+        replay_dead_letters(channel, queue, limit)
+    else:
+        purge_dead_letters(channel, queue)
+    connection.close()
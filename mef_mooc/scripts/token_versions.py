@@ -0,0 +1,82 @@
+import json
+import redis
+from mef_mooc.config import JWT_ACCESS_TOKEN_EXPIRES
+from mef_mooc.scripts.cache import TTLCache
+from mef_mooc.scripts.models import db
+from mef_mooc.scripts.extensions import redis_client, invalidation
+from mef_mooc.scripts.constants import TOKEN_VERSION_CACHE_SIZE, TOKEN_VERSION_CACHE_TTL
+
+TOKEN_VERSION_CHANNEL = 'mef_mooc:token_versions'
+TOKEN_VERSION_KEY = 'mef_mooc:token_version:{}:{}'
+
+# Only tokens of these accounts carry a version, admin tokens are checked by type alone
+VERSION_QUERIES = {
+    'student': "SELECT token_version FROM student WHERE id = %s LIMIT 1",
+    'coordinator': "SELECT token_version FROM coordinator WHERE id = %s and is_active = True LIMIT 1",
+}
+BUMP_QUERIES = {
+    'student': "UPDATE student SET token_version = token_version + 1 WHERE id = ANY(%s) RETURNING id, token_version",
+    'coordinator': "UPDATE coordinator SET token_version = token_version + 1 WHERE id = ANY(%s) RETURNING id, token_version",
+}
+
+token_versions = TTLCache(maxsize=TOKEN_VERSION_CACHE_SIZE, ttl=TOKEN_VERSION_CACHE_TTL)
+
+def get_token_version(account_type, account_id):
+    version = token_versions.get((account_type, account_id))
+    if version is not None:
+        return version
+
+    key = TOKEN_VERSION_KEY.format(account_type, account_id)
+    try:
+        version = redis_client.get(key)
+    except redis.RedisError as e:
+        print(e)
+        version = None
+
+    if version is not None:
+        version = int(version)
+    else:
+        # Inactive coordinators have no version, so none of their tokens match
+        row = db.fetch_one(VERSION_QUERIES[account_type], (account_id,))
+        if not row:
+            return None
+        version = row['token_version']
+        try:
+            # nx keeps a bump that landed after our read from being overwritten with the old version
+            redis_client.set(key, version, ex=JWT_ACCESS_TOKEN_EXPIRES, nx=True)
+        except redis.RedisError as e:
+            print(e)
+
+    token_versions.set((account_type, account_id), version)
+    return version
+
+# Call after the surrounding transaction commits, a rolled back bump would leave Redis ahead of the database
+def bump_token_versions(account_type, *account_ids):
+    account_ids = [account_id for account_id in account_ids if account_id is not None]
+    if not account_ids:
+        return {}
+
+    rows = db.fetch(BUMP_QUERIES[account_type], (account_ids,))
+    for account_id in account_ids:
+        token_versions.delete((account_type, account_id))
+
+    try:
+        pipe = redis_client.pipeline()
+        for row in rows:
+            pipe.set(TOKEN_VERSION_KEY.format(account_type, row['id']), row['token_version'], ex=JWT_ACCESS_TOKEN_EXPIRES)
+        pipe.publish(TOKEN_VERSION_CHANNEL, json.dumps({'type': account_type, 'ids': account_ids}))
+        pipe.execute()
+    except redis.RedisError as e:
+        print(e)
+
+    return {row['id']: row['token_version'] for row in rows}
+
+def on_token_version_message(data):
+    message = json.loads(data)
+    for account_id in message['ids']:
+        token_versions.delete((message['type'], account_id))
+
+def on_token_version_subscribe():
+    token_versions.clear()
+
+invalidation.subscribe(TOKEN_VERSION_CHANNEL, on_token_version_message, on_subscribe=on_token_version_subscribe)
@@ -0,0 +1,275 @@
+import time
+import smtplib
+import itertools
+import threading
+from collections import deque, OrderedDict
+from types import SimpleNamespace
+import pika
+from mef_mooc.config import RABBITMQ_HOST, BROKER_BACKEND, SMTP_BACKEND
+
+class MemoryBroker:
+    # Queues shared by every MemoryConnection of the process, only the default exchange is supported
+    def __init__(self):
+        self.queues = {}
+        self.arguments = {}
+        self.condition = threading.Condition()
+
+    def declare(self, queue, arguments=None):
+        with self.condition:
+            if queue not in self.queues:
+                self.queues[queue] = deque()
+                self.arguments[queue] = dict(arguments or {})
+
+    def publish(self, messages):
+        with self.condition:
+            for queue, properties, body in messages:
+                self.put(queue, properties, body)
+            self.condition.notify_all()
+
+    def put(self, queue, properties, body):
+        # Like the default exchange, a message for an undeclared queue is dropped
+        if queue not in self.queues:
+            return
+
+        ttl = self.arguments[queue].get('x-message-ttl')
+        expires_at = time.monotonic() + ttl / 1000 if ttl is not None else None
+        self.queues[queue].append((properties, body, expires_at))
+
+    def dead_letter(self, queue, properties, body):
+        target = self.arguments[queue].get('x-dead-letter-routing-key')
+        if target is not None:
+            self.put(target, properties, body)
+
+    def expire(self):
+        # Every message of a queue has the same TTL, so only the heads can be due
+        now = time.monotonic()
+        next_expiry = None
+        for queue, messages in self.queues.items():
+            while messages and messages[0][2] is not None and messages[0][2] <= now:
+                properties, body, _ = messages.popleft()
+                self.dead_letter(queue, properties, body)
+            if messages and messages[0][2] is not None:
+                next_expiry = messages[0][2] if next_expiry is None else min(next_expiry, messages[0][2])
+        return next_expiry
+
+class MemoryChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.consumers = {}
+        self.unacked = OrderedDict()
+        self.delivery_tags = itertools.count(1)
+        self.consumer_tags = itertools.count(1)
+        self.prefetch_count = 0
+        self.transaction = None
+        self.is_open = True
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def queue_declare(self, queue, arguments=None, **kwargs):
+        self.broker.declare(queue, arguments)
+
+    def queue_purge(self, queue):
+        with self.broker.condition:
+            messages = self.broker.queues.get(queue, deque())
+            message_count = len(messages)
+            messages.clear()
+        return SimpleNamespace(method=SimpleNamespace(message_count=message_count))
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    def confirm_delivery(self):
+        # Publishes reach the broker before basic_publish returns, there is nothing to wait for
+        pass
+
+    def tx_select(self):
+        self.transaction = list()
+
+    def tx_commit(self):
+        messages, self.transaction = self.transaction, list()
+        self.broker.publish(messages)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        message = (routing_key, properties or pika.BasicProperties(), body)
+
+        if self.transaction is not None:
+            self.transaction.append(message)
+        else:
+            self.broker.publish([message])
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        consumer_tag = 'ctag%d' % next(self.consumer_tags)
+        self.consumers[consumer_tag] = (queue, on_message_callback, auto_ack)
+        return consumer_tag
+
+    def start_consuming(self):
+        while self.consumers and self.is_open:
+            self.connection.run_once(timeout=1)
+
+    def stop_consuming(self):
+        self.consumers.clear()
+
+    def take_deliveries(self):
+        # Called with the broker lock held
+        deliveries = list()
+        for queue, callback, auto_ack in list(self.consumers.values()):
+            messages = self.broker.queues.get(queue)
+            while messages and (auto_ack or not self.prefetch_count or len(self.unacked) < self.prefetch_count):
+                properties, body, _ = messages.popleft()
+                delivery_tag = next(self.delivery_tags)
+                if not auto_ack:
+                    self.unacked[delivery_tag] = (queue, properties, body)
+                method = SimpleNamespace(delivery_tag=delivery_tag, routing_key=queue, redelivered=False)
+                deliveries.append((callback, method, properties, body))
+        return deliveries
+
+    def basic_get(self, queue, auto_ack=False):
+        with self.broker.condition:
+            messages = self.broker.queues.get(queue)
+            if not messages:
+                return None, None, None
+            properties, body, _ = messages.popleft()
+
+        delivery_tag = next(self.delivery_tags)
+        if not auto_ack:
+            self.unacked[delivery_tag] = (queue, properties, body)
+        return SimpleNamespace(delivery_tag=delivery_tag, routing_key=queue, redelivered=False), properties, body
+
+    def settled(self, delivery_tag, multiple):
+        if not multiple:
+            message = self.unacked.pop(delivery_tag, None)
+            return [message] if message is not None else []
+        return [self.unacked.pop(tag) for tag in [tag for tag in self.unacked if tag <= delivery_tag]]
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.settled(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        messages = self.settled(delivery_tag, multiple)
+        with self.broker.condition:
+            for queue, properties, body in reversed(messages):
+                if requeue:
+                    self.broker.queues[queue].appendleft((properties, body, None))
+                else:
+                    self.broker.dead_letter(queue, properties, body)
+            self.broker.condition.notify_all()
+
+    def close(self):
+        if not self.is_open:
+            return
+        self.is_open = False
+        self.consumers.clear()
+        # Like the broker does for a closed channel, unacked messages go back to their queues
+        self.basic_nack(multiple=True, delivery_tag=float('inf'), requeue=True)
+
+class MemoryConnection:
+    # Enough of pika.BlockingConnection for util.Publisher, receiver.py and the retries tooling
+    def __init__(self, broker):
+        self.broker = broker
+        self.channels = list()
+        self.callbacks = deque()
+        self.timers = {}
+        self.timer_ids = itertools.count(1)
+        self.is_open = True
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self):
+        channel = MemoryChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        with self.broker.condition:
+            self.callbacks.append(callback)
+            self.broker.condition.notify_all()
+
+    def call_later(self, delay, callback):
+        timer_id = next(self.timer_ids)
+        self.timers[timer_id] = (time.monotonic() + delay, callback)
+        return timer_id
+
+    def remove_timeout(self, timer_id):
+        self.timers.pop(timer_id, None)
+
+    def run_once(self, timeout):
+        with self.broker.condition:
+            next_expiry = self.broker.expire()
+            callbacks = list(self.callbacks)
+            self.callbacks.clear()
+            deliveries = [(channel, delivery) for channel in self.channels if channel.is_open
+                          for delivery in channel.take_deliveries()]
+
+            now = time.monotonic()
+            due = [timer_id for timer_id, (due_at, _) in self.timers.items() if due_at <= now]
+            if not callbacks and not deliveries and not due:
+                wake_at = [now + timeout] + [due_at for due_at, _ in self.timers.values()]
+                if next_expiry is not None:
+                    wake_at.append(next_expiry)
+                self.broker.condition.wait(max(0, min(wake_at) - now))
+                return
+
+        for callback in callbacks:
+            callback()
+        for timer_id in due:
+            timer = self.timers.pop(timer_id, None)
+            if timer is not None:
+                timer[1]()
+        for channel, (callback, method, properties, body) in deliveries:
+            callback(channel, method, properties, body)
+
+    def process_data_events(self, time_limit=0):
+        self.run_once(timeout=time_limit or 0)
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
+        self.is_open = False
+
+memory_broker = MemoryBroker()
+
+def connect_broker(host=RABBITMQ_HOST):
+    if BROKER_BACKEND == 'memory':
+        return MemoryConnection(memory_broker)
+    return pika.BlockingConnection(pika.ConnectionParameters(host=host))
+
+class CaptureSMTP:
+    # Stands in for smtplib.SMTP and keeps the mails instead of sending them
+    delay = 0
+    lock = threading.Lock()
+    messages = list()
+
+    def __init__(self, host=None, port=None, timeout=None):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        pass
+
+    def noop(self):
+        return 250, b'OK'
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        # Simulates the DATA round trip of a real server
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            self.messages.append((from_addr, to_addrs, msg))
+        return {}
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+smtp_transport = CaptureSMTP if SMTP_BACKEND == 'capture' else smtplib.SMTP
@@ -1,7 +1,17 @@
+import os
 import pika
+import queue
 import random
 import string
-from mef_mooc.scripts.constants import FRONTEND_URL
+import threading
+from contextlib import contextmanager
+from flask import Response, current_app, stream_with_context
+from mef_mooc.config import RABBITMQ_HOST
+from mef_mooc.scripts.mail_templates import TEMPLATE_IDS
+from mef_mooc.scripts.transports import connect_broker
+from mef_mooc.scripts.outbox import enqueue, enqueue_many
+from mef_mooc.scripts.messages import MAIL, DB_EXEC, CONTENT_TYPE, encode_message, current_trace_id
+from mef_mooc.scripts.constants import STREAM_FLUSH_ROWS, PUBLISH_ATTEMPTS, PUBLISHER_POOL_SIZE
 
 SEMESTERS = ["2022-2023-Fall", "2022-2023-Spring", "2022-2023-Summer", "2023-2024-Fall", 
              "2023-2024-Spring", "2023-2024-Summer", "2024-2025-Fall", "2024-2025-Spring", 
@@ -28,69 +38,156 @@ BUNDLE_STATUS = {
 def create_random_password(number_of_characters=8):
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=number_of_characters))
 
+def stream_json_response(key, rows):
+    rows = iter(rows)
+    # Pull the first row here so query errors are raised before the response has started
+    first_row = next(rows, None)
+
+    def generate():
+        yield '{"%s": [' % key
+        if first_row is None:
+            yield ']}'
+            return
+
+        chunk = [current_app.json.dumps(first_row)]
+        for row in rows:
+            if len(chunk) >= STREAM_FLUSH_ROWS:
+                yield ','.join(chunk)
+                # The empty head makes the next chunk start with its separator
+                chunk = ['']
+            chunk.append(current_app.json.dumps(row))
+        yield ','.join(chunk) + ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+MESSAGE_PROPERTIES = pika.BasicProperties(content_type=CONTENT_TYPE)
+
+class Publisher:
+    def __init__(self, host, queues, attempts=PUBLISH_ATTEMPTS, size=PUBLISHER_POOL_SIZE):
+        self.host = host
+        self.queues = queues
+        self.attempts = attempts
+        self.size = size
+        # pika connections are not thread safe, a connection is lent to one thread at a time.
+        # Threads come and go with requests, the pool keeps the number of broker connections fixed
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        # A forked worker must not share its parent's sockets, or locks another parent thread held
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(self.size)
+
+    def connect(self):
+        connection = connect_broker(self.host)
+        confirm_channel = connection.channel()
+        confirm_channel.confirm_delivery()
+        # Batches go through a transaction so the whole batch is confirmed by a single commit
+        batch_channel = connection.channel()
+        batch_channel.tx_select()
+
+        for name in self.queues:
+            confirm_channel.queue_declare(queue=name)
+        return connection, confirm_channel, batch_channel
+
+    def close(self, connection):
+        try:
+            if connection.is_open:
+                connection.close()
+        except pika.exceptions.AMQPError:
+            pass
+
+    @contextmanager
+    def channels(self):
+        with self.slots:
+            try:
+                connection, confirm_channel, batch_channel = self.idle.get_nowait()
+            except queue.Empty:
+                connection = None
+
+            if connection is None or connection.is_closed:
+                connection, confirm_channel, batch_channel = self.connect()
+
+            try:
+                # Answers pending heartbeats and notices a connection the broker has closed
+                connection.process_data_events(time_limit=0)
+                yield confirm_channel, batch_channel
+            except Exception:
+                self.close(connection)
+                raise
+            self.idle.put((connection, confirm_channel, batch_channel))
+
+    def close_all(self):
+        while True:
+            try:
+                connection, _, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self.close(connection)
+
+    def publish(self, queue, body):
+        self.publish_batch(queue, [body])
+
+    def publish_batch(self, queue, bodies):
+        if not bodies:
+            return
+
+        for attempt in range(1, self.attempts + 1):
+            try:
+                with self.channels() as (confirm_channel, batch_channel):
+                    if len(bodies) == 1:
+                        confirm_channel.basic_publish(exchange='', routing_key=queue, body=bodies[0],
+                                                      properties=MESSAGE_PROPERTIES)
+                    else:
+                        for body in bodies:
+                            batch_channel.basic_publish(exchange='', routing_key=queue, body=body,
+                                                        properties=MESSAGE_PROPERTIES)
+                        batch_channel.tx_commit()
+                return
+            except pika.exceptions.AMQPError as e:
+                if attempt == self.attempts:
+                    raise e
+
+publisher = Publisher(RABBITMQ_HOST, ('mail_sending', 'mail_bulk', 'db_exec'))
+
 def student_invite_mail_queue(students):
     if not isinstance(students, list):
         raise TypeError("Students must be a list")
-    
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-    except Exception as e:
-        print(e)
-        raise e
-    
-    channel = connection.channel()
-    channel.queue_declare(queue='mail_sending')
 
+    bodies = list()
+    trace_id = current_trace_id()
     for student in students:
-        email = student['email']
-        password = student['password']
-        
+        # Students who already have an account are invited again without a new password
         body = {
-            'email': email,
-            'subject': 'MEF MOOC Invitation',
-            'body': f'You have been invited to MEF MOOC.\n{FRONTEND_URL}\n\nYou can login with your email and password.\nYour password is {password}.'
+            'email': student['email'],
+            'template': 'invitation',
+            'params': {'password': student['password']} if 'password' in student else {}
         }
+        bodies.append(encode_message(MAIL, body, trace_id))
 
-        channel.basic_publish(exchange='', routing_key='mail_sending', body=str(body))
-    
-    connection.close()
+    # Invitation waves go to the bulk lane so they never queue ahead of transactional mails
+    enqueue_many('mail_bulk', bodies)
 
-def send_mail_queue(email, subject, body):
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-    except Exception as e:
-        print(e)
-        return
-    
-    channel = connection.channel()
-    channel.queue_declare(queue='mail_sending')
+def send_mail_queue(email, template, params=None, locale=None, bulk=False):
+    # Unknown ids fail here, in the request that sent them, rather than in the receiver
+    if template not in TEMPLATE_IDS:
+        raise KeyError("Unknown mail template %s" % template)
 
     body = {
         'email': email,
-        'subject': subject,
-        'body': body
+        'template': template,
+        'params': params or {}
     }
+    if locale:
+        body['locale'] = locale
 
-    channel.basic_publish(exchange='', routing_key='mail_sending', body=str(body))
-    
-    connection.close()
+    enqueue('mail_bulk' if bulk else 'mail_sending', encode_message(MAIL, body))
 
 def db_exec_queue(query, params=()):
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-    except Exception as e:
-        print(e)
-        return
-    
-    channel = connection.channel()
-    channel.queue_declare(queue='db_exec')
-
     body = {
         'query': query,
-        'params': params
+        'params': list(params)
     }
 
-    channel.basic_publish(exchange='', routing_key='db_exec', body=str(body))
-    
-    connection.close()
-
+    enqueue('db_exec', encode_message(DB_EXEC, body))
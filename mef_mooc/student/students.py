@@ -1,12 +1,13 @@
 from flask import Blueprint, request
 from flask_jwt_extended import create_access_token, get_jwt
 from flask_bcrypt import generate_password_hash
-from mef_mooc.scripts.auth import student_auth
+from mef_mooc.scripts.auth import student_auth, current_student, current_department_id
 from mef_mooc.scripts.models import db
-from mef_mooc.scripts.extensions import jwt, bcrypt, jwt_redis_blocklist
+from mef_mooc.scripts.extensions import jwt, bcrypt, revoke_token
+from mef_mooc.scripts.token_versions import bump_token_versions
+from mef_mooc.scripts.catalog import catalog_response
 from mef_mooc.scripts.util import create_random_password, send_mail_queue
 from mef_mooc.scripts.constants import TOTAL_COURSE_TIME_TOLLERANCE, HOURS_PER_CREDIT
-from mef_mooc.config import JWT_ACCESS_TOKEN_EXPIRES
 
 student_app = Blueprint('student_app', __name__, url_prefix='/student')
 
@@ -26,7 +27,9 @@ def student_login():
 
         token_identity = {
             'type': 'student',
-            'id': student['id']
+            'id': student['id'],
+            'department_id': student['department_id'],
+            'token_version': student['token_version']
         }
 
         access_token = create_access_token(identity=token_identity)
@@ -39,8 +42,7 @@ def student_login():
 @student_auth()
 def student_logout():
     try:
-        jti = get_jwt()['jti']
-        jwt_redis_blocklist.set(jti, '', JWT_ACCESS_TOKEN_EXPIRES)
+        revoke_token(get_jwt())
         return {"message": "Successfully logged out"}, 200
     except Exception as e:
         print(e)
@@ -57,11 +59,10 @@ def student_forgot_password():
 
         password = create_random_password()
         hashed_password = generate_password_hash(password).decode('utf-8')
-        db.execute("UPDATE student SET password = %s WHERE id = %s", (hashed_password, student['id']))
-        send_mail_queue(
-            email, 
-            "MEF MOOC Password Reset", 
-            "Your MEF MOOC password reset succesfully.\nNew password: " + password)
+        with db.transaction():
+            db.execute("UPDATE student SET password = %s WHERE id = %s", (hashed_password, student['id']))
+            send_mail_queue(email, "password_reset", {"password": password})
+        bump_token_versions('student', student['id'])
         
         return {"message": "Password reset mail sent"}, 200
     except Exception as e:
@@ -72,13 +73,7 @@ def student_forgot_password():
 @student_auth()
 def student_profile():
     try:
-        student_id = get_jwt()['sub']['id']
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-        if not student:
-            return {"message": "Student not found"}, 404
-
-        department = db.fetch_one("SELECT * FROM department WHERE id = %s LIMIT 1", (student['department_id'],))
-        student['department'] = department["name"]
+        student = current_student()
 
         # REMOVE PASSWORD
         del student['password']
@@ -93,20 +88,21 @@ def student_profile():
 def student_change_password():
     try:
         data = request.get_json()
-        student_id = get_jwt()['sub']['id']
         old_password = data['old_password']
         new_password = data['new_password']
 
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-        if not student:
-            return {"message": "Student not found"}, 404
+        student = current_student()
 
         if not bcrypt.check_password_hash(student['password'], old_password):
             return {"message": "Invalid credentials"}, 401
 
         hashed_password = generate_password_hash(new_password).decode('utf-8')
         db.execute("UPDATE student SET password = %s WHERE id = %s", (hashed_password, student['id']))
-        return {"message": "Password changed"}, 200
+
+        # Other sessions are logged out by the new version, this one continues with a fresh token
+        token_identity = dict(get_jwt()['sub'], token_version=bump_token_versions('student', student['id'])[student['id']])
+        access_token = create_access_token(identity=token_identity)
+        return {"message": "Password changed", "access_token": access_token}, 200
     except Exception as e:
         print(e)
         return {"message": "An error occured"}, 500
@@ -116,10 +112,7 @@ def student_change_password():
 def student_courses():
     try:
         student_id = get_jwt()['sub']['id']
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-
-        if not student:
-            return {"message": "Student not found"}, 404
+        department_id = current_department_id()
 
         courses = db.fetch("""
                             SELECT id, name, course_code, semester, credits
@@ -129,7 +122,7 @@ def student_courses():
                                                 WHERE enrollment.student_id = %s
                                                 and enrollment.course_id = m.id)
             """,
-            (student['department_id'], student_id,)
+            (department_id, student_id,)
         )
         return {"courses": courses}, 200
     except Exception as e:
@@ -144,15 +137,13 @@ def student_enroll():
         student_id = get_jwt()['sub']['id']
         course_id = data['course_id']
 
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-        if not student:
-            return {"message": "Student not found"}, 404
+        department_id = current_department_id()
 
-        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s and department_id = %s and is_active = True LIMIT 1", (course_id, student['department_id'],))
+        course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s and department_id = %s and is_active = True LIMIT 1", (course_id, department_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        if course['department_id'] != student['department_id']:
+        if course['department_id'] != department_id:
             return {"message": "You cannot enroll in this course"}, 400
 
         enrollment = db.fetch_one("SELECT * FROM enrollment WHERE student_id = %s and course_id = %s LIMIT 1", (student_id, course_id))
@@ -186,10 +177,6 @@ def student_enroll():
 def student_enrollments():
     try:
         student_id = get_jwt()['sub']['id']
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-
-        if not student:
-            return {"message": "Student not found"}, 404
 
         enrollments = db.fetch(
             """SELECT e.id as enrolment_id, e.is_waiting, c.id as course_id, c.name, c.course_code, c.semester, c.credits
@@ -209,16 +196,13 @@ def student_enrollments():
 def student_enrollment_bundles(course_id):
     try:
         student_id = get_jwt()['sub']['id']
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-
-        if not student:
-            return {"message": "Student not found"}, 404
+        department_id = current_department_id()
 
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s and is_active = True LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        if course['department_id'] != student['department_id']:
+        if course['department_id'] != department_id:
             return {"message": "You cannot view this course"}, 400
 
         enrollment = db.fetch_one("SELECT * FROM enrollment WHERE student_id = %s and course_id = %s LIMIT 1", (student_id, course_id))
@@ -246,14 +230,7 @@ def student_enrollment_bundles(course_id):
 @student_auth()
 def student_moocs():
     try:
-        student_id = get_jwt()['sub']['id']
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-
-        if not student:
-            return {"message": "Student not found"}, 404
-
-        moocs = db.fetch("SELECT id, name, url, average_hours FROM mooc WHERE is_active = True")
-        return {"moocs": moocs}, 200
+        return catalog_response('active')
     except Exception as e:
         print(e)
         return {"message": "An error occured"}, 500
@@ -263,16 +240,13 @@ def student_moocs():
 def student_create_bundle(course_id):
     try:
         student_id = get_jwt()['sub']['id']
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-
-        if not student:
-            return {"message": "Student not found"}, 404
+        department_id = current_department_id()
 
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s and is_active = True LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        if course['department_id'] != student['department_id']:
+        if course['department_id'] != department_id:
             return {"message": "You cannot view this course"}, 400
 
         enrollment = db.fetch_one("SELECT * FROM enrollment WHERE student_id = %s and course_id = %s and is_waiting = False LIMIT 1", (student_id, course_id))
@@ -314,16 +288,9 @@ def student_create_bundle(course_id):
         if course['credits'] * HOURS_PER_CREDIT * (1.0 - TOTAL_COURSE_TIME_TOLLERANCE) > total_course_time:
             total_course_time_message = "You have to take at least {} hours of moocs".format(course['credits'] * HOURS_PER_CREDIT)
         
-        try:
-            bundle = db.execute("INSERT INTO bundle (enrollment_id) VALUES (%s)", (enrollment['id'],))
-            bundle_id = db.fetch_one("SELECT id FROM bundle WHERE enrollment_id = %s ORDER BY id DESC LIMIT 1", (enrollment['id'],))["id"]
-            for mooc in mooc_ids:
-                db.execute("INSERT INTO bundle_detail (bundle_id, mooc_id) VALUES (%s, %s)", (bundle_id, mooc))
-
-        # TODO: ROllback
-        except Exception as e:
-            print(e)
-            return {"message": "An error occured"}, 500
+        with db.transaction():
+            bundle_id = db.fetch_one("INSERT INTO bundle (enrollment_id) VALUES (%s) RETURNING id", (enrollment['id'],))["id"]
+            db.insert_many("bundle_detail", ("bundle_id", "mooc_id"), [(bundle_id, mooc) for mooc in mooc_ids])
 
         message = "Bundle created successfully" + (". " + total_course_time_message if total_course_time_message else "")
         return {"message": "Bundle created successfully"}, 200
@@ -336,16 +303,13 @@ def student_create_bundle(course_id):
 def student_bundle(course_id, bundle_id):
     try:
         student_id = get_jwt()['sub']['id']
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-
-        if not student:
-            return {"message": "Student not found"}, 404
+        department_id = current_department_id()
 
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s and is_active = True LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        if course['department_id'] != student['department_id']:
+        if course['department_id'] != department_id:
             return {"message": "You cannot view this course"}, 400
 
         enrollment = db.fetch_one("SELECT * FROM enrollment WHERE student_id = %s and course_id = %s and is_waiting = False LIMIT 1", (student_id, course_id))
@@ -372,16 +336,13 @@ def student_bundle(course_id, bundle_id):
 def student_create_certificate(course_id, bundle_id):
     try:
         student_id = get_jwt()['sub']['id']
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-
-        if not student:
-            return {"message": "Student not found"}, 404
+        department_id = current_department_id()
 
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s and is_active = True LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        if course['department_id'] != student['department_id']:
+        if course['department_id'] != department_id:
             return {"message": "You cannot view this course"}, 400
 
         enrollment = db.fetch_one("SELECT * FROM enrollment WHERE student_id = %s and course_id = %s and is_waiting = False LIMIT 1", (student_id, course_id))
@@ -411,16 +372,13 @@ def student_create_certificate(course_id, bundle_id):
 def student_complete_bundle(course_id, bundle_id):
     try:
         student_id = get_jwt()['sub']['id']
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-
-        if not student:
-            return {"message": "Student not found"}, 404
+        department_id = current_department_id()
 
         course = db.fetch_one("SELECT * FROM MEFcourse WHERE id = %s and is_active = True LIMIT 1", (course_id,))
         if not course:
             return {"message": "Course not found"}, 404
 
-        if course['department_id'] != student['department_id']:
+        if course['department_id'] != department_id:
             return {"message": "You cannot view this course"}, 400
 
         enrollment = db.fetch_one("SELECT * FROM enrollment WHERE student_id = %s and course_id = %s and is_waiting = False LIMIT 1", (student_id, course_id))
@@ -453,10 +411,6 @@ def student_complete_bundle(course_id, bundle_id):
 def student_old_courses():
     try:
         student_id = get_jwt()['sub']['id']
-        student = db.fetch_one("SELECT * FROM student WHERE id = %s LIMIT 1", (student_id,))
-
-        if not student:
-            return {"message": "Student not found"}, 404
 
         old_courses = db.fetch(
             """
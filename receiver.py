@@ -1,49 +1,260 @@
-import pika
 import sys
 import os
 import time
-from mef_mooc.config import RABBITMQ_HOST
-from mef_mooc.scripts.mail_sender import send_mail
+import signal
+import threading
+import smtplib
+import functools
+import itertools
+import psycopg2
+import jinja2
+from concurrent.futures import ThreadPoolExecutor
+from mef_mooc.config import (MAIL_WORKERS, MAIL_PREFETCH, MAIL_RATE, MAIL_BULK_WORKERS, MAIL_BULK_PREFETCH, MAIL_BULK_RATE,
+                             MAIL_DIGEST_WINDOW, DB_EXEC_BATCH_SIZE, DB_EXEC_BATCH_WAIT)
+from mef_mooc.scripts.mail_sender import send_mail, smtp_pool
+from mef_mooc.scripts.mail_templates import render_mail
 from mef_mooc.scripts.models import db
+from mef_mooc.scripts.messages import MAIL, DB_EXEC, MessageError, decode_message
+from mef_mooc.scripts.notifications import (is_repeated, remember_mail, is_digested, add_to_digest, send_digest,
+                                            declare_digest_queue)
+from mef_mooc.scripts.retries import declare_queues, retry_or_dead_letter
+from mef_mooc.scripts.transports import connect_broker
+from mef_mooc.scripts.util import publisher
 
-def main():
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
-    channel = connection.channel()
+# Failures that will happen again on every attempt go straight to the dead letter queue
+MAIL_POISON = (MessageError, KeyError, TypeError, jinja2.TemplateError, smtplib.SMTPRecipientsRefused)
+DB_POISON = (MessageError, KeyError, TypeError, psycopg2.DataError, psycopg2.IntegrityError, psycopg2.ProgrammingError)
+
+def handle_mail(body, queue='mail_sending'):
+    mail = decode_message(body, MAIL)['payload']
+
+    email = mail['email']
+    if mail.get('digest'):
+        send_digest(publisher, queue, email, send_mail)
+        return
+
+    if 'template' not in mail:
+        # Messages queued before templates carried the rendered text
+        send_mail(mail['subject'], mail['body'], email)
+        return
+
+    if is_repeated(mail):
+        print(" [-] Skipped a repeated %s mail to %s" % (mail['template'], email))
+        return
+
+    if is_digested(mail):
+        add_to_digest(publisher, queue, mail)
+    else:
+        subject, body = render_mail(mail['template'], mail['params'], mail.get('locale'))
+        send_mail(subject, body, email)
+    remember_mail(mail)
+
+def handle_db_batch(bodies):
+    failures = {}
+    statements = list()
+    for index, body in enumerate(bodies):
+        try:
+            message = decode_message(body, DB_EXEC)['payload']
+            statements.append((index, message['query'], message['params']))
+        except Exception as e:
+            failures[index] = e
+
+    with db.transaction():
+        # Runs of the same statement are batched, order across different statements is kept
+        for query, group in itertools.groupby(statements, key=lambda statement: statement[1]):
+            group = list(group)
+            try:
+                with db.savepoint():
+                    db.execute_many(query, [params for _, _, params in group])
+                continue
+            except Exception as e:
+                print(e)
+
+            # One bad row fails the whole run, so find it by running them one by one
+            for index, _, params in group:
+                try:
+                    with db.savepoint():
+                        db.execute(query, params)
+                except Exception as e:
+                    failures[index] = e
+    return failures
 
-    channel.queue_declare(queue='mail_sending')
-    channel.queue_declare(queue='db_exec')
+class RateLimiter:
+    # Spaces calls evenly so a lane never sends faster than its rate
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
 
-    def callback_mail(ch, method, properties, body):
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+class Consumer:
+    def __init__(self, connection, channel, queue, handler, workers, poison=(), rate=0):
+        self.connection = connection
+        self.channel = channel
+        self.queue = queue
+        self.handler = handler
+        self.poison = poison
+        self.rate_limiter = RateLimiter(rate) if rate else None
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=queue)
+
+    def start(self):
+        self.channel.basic_consume(queue=self.queue, on_message_callback=self.on_message)
+
+    def on_message(self, ch, method, properties, body):
         print(" [x] Received %r" % body)
+        # The prefetch count bounds how many messages can be waiting here
+        self.pool.submit(self.run, method.delivery_tag, properties, body)
+
+    def run(self, delivery_tag, properties, body):
+        error = None
         try:
-            mail = eval(body.decode())
-            
-            email = mail['email']
-            subject = mail['subject']
-            body = mail['body']
-            send_mail(subject, body, email)
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            self.handler(body)
         except Exception as e:
             print(e)
-            pass
-        time.sleep(1)
+            error = e
 
-    def callback_db(ch, method, properties, body):
-        print(" [x] Received %r" % body)
+        # Channels belong to the connection thread, the ack is handed back to it
+        self.connection.add_callback_threadsafe(functools.partial(self.settle, delivery_tag, properties, body, error))
+
+    def settle(self, delivery_tag, properties, body, error):
+        if not self.channel.is_open:
+            # The broker redelivers everything unacked once the channel is gone
+            return
+
+        if error is not None:
+            target = retry_or_dead_letter(self.channel, self.queue, body, properties, error,
+                                          poison=isinstance(error, self.poison))
+            print(" [!] Moved to %s" % target)
+        self.channel.basic_ack(delivery_tag=delivery_tag)
+
+    def drain(self):
+        self.pool.shutdown(wait=True)
+
+class BatchConsumer(Consumer):
+    def __init__(self, connection, channel, queue, handler, batch_size, batch_wait, poison=()):
+        super().__init__(connection, channel, queue, handler, 1, poison)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.pending = list()
+        self.timer = None
+
+    def on_message(self, ch, method, properties, body):
+        self.pending.append((method.delivery_tag, properties, body))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.connection.call_later(self.batch_wait, self.on_timer)
+
+    def on_timer(self):
+        self.timer = None
+        self.flush()
+
+    def flush(self):
+        if self.timer is not None:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+
+        if self.pending:
+            batch, self.pending = self.pending, list()
+            print(" [x] Received a batch of %d" % len(batch))
+            self.pool.submit(self.run_batch, batch)
+
+    def run_batch(self, batch):
         try:
-            db = eval(body.decode())
-            query = db['query']
-            params = db['params']
-            print("\nQuery: ", query, "\n")
-            print("\nParams: ", params, "\n")
-            db.execute(query, params)
+            failures = self.handler([body for _, _, body in batch])
         except Exception as e:
+            # Nothing was committed, every message of the batch failed with it
             print(e)
-            pass
-        time.sleep(1)
+            failures = {index: e for index in range(len(batch))}
+
+        self.connection.add_callback_threadsafe(functools.partial(self.settle_batch, batch, failures))
+
+    def settle_batch(self, batch, failures):
+        if not self.channel.is_open:
+            return
+
+        for index, error in failures.items():
+            _, properties, body = batch[index]
+            retry_or_dead_letter(self.channel, self.queue, body, properties, error, poison=isinstance(error, self.poison))
+        if failures:
+            print(" [!] %d message(s) of the batch failed" % len(failures))
+
+        # Batches are settled in order by the single worker, so this acks exactly this batch
+        self.channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+
+    def drain(self):
+        if self.connection.is_open:
+            self.flush()
+        super().drain()
+
+def start_consumers(connection):
+    channel = connection.channel()
+
+    declare_queues(channel, 'mail_sending')
+    declare_queues(channel, 'mail_bulk')
+    declare_queues(channel, 'db_exec')
+    if MAIL_DIGEST_WINDOW:
+        declare_digest_queue(channel, 'mail_sending')
+        declare_digest_queue(channel, 'mail_bulk')
+    channel.basic_qos(prefetch_count=MAIL_PREFETCH)
 
-    channel.basic_consume(queue='db_exec', on_message_callback=callback_db, auto_ack=True)
-    channel.basic_consume(queue='mail_sending', on_message_callback=callback_mail, auto_ack=True)
-    channel.start_consuming()
+    mail_consumer = Consumer(connection, channel, 'mail_sending', handle_mail, MAIL_WORKERS, poison=MAIL_POISON, rate=MAIL_RATE)
+
+    # Bulk mails get their own channel, workers and rate, a backlog there leaves the transactional lane idle and fast
+    bulk_channel = connection.channel()
+    bulk_channel.basic_qos(prefetch_count=MAIL_BULK_PREFETCH)
+    bulk_consumer = Consumer(connection, bulk_channel, 'mail_bulk', functools.partial(handle_mail, queue='mail_bulk'),
+                             MAIL_BULK_WORKERS, poison=MAIL_POISON, rate=MAIL_BULK_RATE)
+
+    # Deferred writes are committed in batches and acked once their batch has committed
+    db_channel = connection.channel()
+    db_channel.basic_qos(prefetch_count=DB_EXEC_BATCH_SIZE)
+    db_consumer = BatchConsumer(connection, db_channel, 'db_exec', handle_db_batch, DB_EXEC_BATCH_SIZE, DB_EXEC_BATCH_WAIT,
+                                poison=DB_POISON)
+
+    db_consumer.start()
+    bulk_consumer.start()
+    mail_consumer.start()
+    return channel, [mail_consumer, bulk_consumer, db_consumer]
+
+def stop_consumers(connection, consumers):
+    if connection.is_open:
+        for consumer in consumers:
+            consumer.channel.stop_consuming()
+    for consumer in consumers:
+        consumer.drain()
+    smtp_pool.close_all()
+
+    if connection.is_open:
+        # Runs the acks the workers queued while finishing
+        connection.process_data_events(time_limit=0)
+        connection.close()
+
+def main():
+    connection = connect_broker()
+    channel, consumers = start_consumers(connection)
+
+    def shutdown(signum, frame):
+        print(' [*] Stopping, finishing the messages in progress')
+        connection.add_callback_threadsafe(channel.stop_consuming)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    try:
+        channel.start_consuming()
+    finally:
+        stop_consumers(connection, consumers)
+        publisher.close_all()
 
 if __name__ == '__main__':
     try:
@@ -54,4 +265,4 @@ if __name__ == '__main__':
         try:
             sys.exit(0)
         except SystemExit:
-            os._exit(0)
\ No newline at end of file
+            os._exit(0)
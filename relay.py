@@ -0,0 +1,86 @@
+import sys
+import os
+import time
+import select
+import signal
+import itertools
+import pika
+import psycopg2
+from mef_mooc.config import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL
+from mef_mooc.scripts.models import db
+from mef_mooc.scripts.outbox import OUTBOX_CHANNEL
+from mef_mooc.scripts.util import publisher
+
+stopping = False
+
+def relay_batch(batch_size):
+    with db.transaction():
+        # SKIP LOCKED lets several relays share the table without publishing a row twice
+        rows = db.fetch("SELECT id, queue, body FROM outbox ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED", (batch_size,))
+        if not rows:
+            return 0
+
+        for queue, group in itertools.groupby(rows, key=lambda row: row['queue']):
+            publisher.publish_batch(queue, [row['body'] for row in group])
+
+        # A crash between the publish and this commit publishes the rows again, consumers see at least once delivery
+        db.execute("DELETE FROM outbox WHERE id = ANY(%s)", ([row['id'] for row in rows],))
+    return len(rows)
+
+def listen():
+    listener = db.checkout()
+    with listener.cursor() as cursor:
+        cursor.execute("LISTEN " + OUTBOX_CHANNEL)
+    return listener
+
+def wait_for_rows(listener, timeout):
+    if select.select([listener], [], [], timeout) != ([], [], []):
+        listener.poll()
+        listener.notifies.clear()
+
+def main():
+    listener = listen()
+    try:
+        while not stopping:
+            try:
+                relayed = relay_batch(OUTBOX_BATCH_SIZE)
+            except (pika.exceptions.AMQPError, psycopg2.Error) as e:
+                print(e)
+                time.sleep(1)
+                continue
+
+            if relayed:
+                print(" [x] Relayed %d message(s)" % relayed)
+            if relayed == OUTBOX_BATCH_SIZE:
+                continue
+
+            # The timeout keeps rows moving even when a notification is missed
+            try:
+                wait_for_rows(listener, OUTBOX_POLL_INTERVAL)
+            except psycopg2.Error as e:
+                print(e)
+                db.checkin(listener)
+                listener = None
+                listener = listen()
+    finally:
+        if listener is not None:
+            db.checkin(listener)
+        publisher.close_all()
+
+def shutdown(signum, frame):
+    global stopping
+    print(' [*] Stopping after the current batch')
+    stopping = True
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    try:
+        print(' [*] Relaying the outbox. To exit press CTRL+C')
+        main()
+    except KeyboardInterrupt:
+        print('Interrupted')
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)